@@ -0,0 +1,213 @@
+# benchmark.py
+# stock.py 핵심 함수들의 지연 시간(p50/p99)과 메모리를 가상 데이터로 측정합니다.
+#   python benchmark.py                                  # 유저 1만 명 x 8종목
+#   python benchmark.py --scales 10000x8,100000x500,1000000x5000 --out after.json --compare before.json
+# 규모마다 새 프로세스를 띄워 임시 폴더에서 stock 모듈을 import 하므로 실제 데이터 파일은 건드리지 않습니다.
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+try:
+    import resource  # 유닉스 전용
+except ImportError:
+    resource = None
+
+DEFAULT_SCALES = "10000x8"
+DEFAULT_OPS = 2000        # 거래/조회 함수별 측정 횟수
+DEFAULT_TICKS = 20        # 시세 갱신 측정 횟수
+DEFAULT_SAVES = 3         # 전체 저장(save_users/save_data) 측정 횟수
+HOLDINGS_PER_USER = 3     # 유저 한 명이 보유한 평균 종목 수
+SECTORS = ["IT", "자동차", "바이오", "금융", "소비재"]
+
+
+def _rss_mb():
+    if resource is None:
+        return None
+    # 리눅스는 KB, macOS 는 바이트 단위입니다.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _summarize(samples_ns):
+    samples = sorted(samples_ns)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] / 1000
+    return {
+        "n": len(samples),
+        "p50_us": round(pick(0.50), 2),
+        "p99_us": round(pick(0.99), 2),
+        "mean_us": round(sum(samples) / len(samples) / 1000, 2),
+        "max_us": round(samples[-1] / 1000, 2),
+    }
+
+
+def _time_calls(func, args_list):
+    samples = []
+    perf = time.perf_counter_ns
+    for args in args_list:
+        started = perf()
+        func(*args)
+        samples.append(perf() - started)
+    return _summarize(samples)
+
+
+def generate_data(user_count, ticker_count, rng):
+    """가상 종목/유저 데이터를 stocks.json / users.json 형식으로 만듭니다."""
+    tickers = [f"T{i:04d}" for i in range(ticker_count)]
+    stocks = {name: {"price": round(rng.uniform(10, 1000), 2), "sector": SECTORS[i % len(SECTORS)],
+                     "volatility": round(rng.uniform(0.5, 2.5), 2), "total_shares": 10 ** 9, "available_shares": 10 ** 9}
+              for i, name in enumerate(tickers)}
+    users = {}
+    for i in range(user_count):
+        holdings = {}
+        for name in rng.sample(tickers, min(ticker_count, rng.randint(0, HOLDINGS_PER_USER * 2))):
+            quantity = rng.randint(10, 1000)
+            holdings[name] = [quantity, stocks[name]["price"]]
+            stocks[name]["available_shares"] -= quantity
+        users[str(10 ** 17 + i)] = {"balance": round(rng.uniform(0, 10 ** 7), 2), "stocks": holdings, "last_claim_date": None}
+    return stocks, users
+
+
+def run_scale(user_count, ticker_count, ops, ticks, saves, seed):
+    """(하위 프로세스) 한 가지 규모를 측정해 결과 딕셔너리를 돌려줍니다."""
+    rng = random.Random(seed)
+    workdir = tempfile.mkdtemp(prefix="stock-bench-")
+    stocks_data, users_data = generate_data(user_count, ticker_count, rng)
+    with open(os.path.join(workdir, "stocks.json"), "w", encoding="utf-8") as f:
+        json.dump(stocks_data, f)
+    with open(os.path.join(workdir, "users.json"), "w", encoding="utf-8") as f:
+        json.dump(users_data, f)
+    del stocks_data, users_data
+
+    # 처음 읽을 때는 유저 요약(users.index 또는 SQLite 요약 테이블)을 만드느라 유저 전체를 한 번 훑습니다.
+    # 봇을 다시 시작할 때와 같은 조건으로 로드를 재도록, 그 한 번은 별도 프로세스에서 미리 끝내 둡니다.
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import stock"], cwd=workdir, check=True, stdout=subprocess.DEVNULL,
+                   env=dict(os.environ, PYTHONPATH=repo_dir))
+    migrate_seconds = time.perf_counter() - started
+
+    # stock 모듈은 import 시점에 현재 폴더의 데이터 파일을 읽으므로 임시 폴더로 옮긴 뒤 import 합니다.
+    os.chdir(workdir)
+    sys.path.insert(0, repo_dir)
+    rss_before = _rss_mb()
+    started = time.perf_counter()
+    import stock
+    load_seconds = time.perf_counter() - started
+    rss_after = _rss_mb()
+
+    # 저장 스레드를 긴 간격으로 띄워 두면 거래 중에는 변경 표시만 하고, 저장은 아래에서 따로 잽니다.
+    stock._persistence.interval = 3600
+    stock._persistence.start()
+
+    user_ids = list(stock.users)
+    tickers = list(stock.stocks.names)
+    holdings = [(user_id, name) for user_id in rng.sample(user_ids, min(len(user_ids), ops))
+                for name in stock.users[user_id]["stocks"]]
+    results = {}
+    results["buy_stock"] = _time_calls(stock.buy_stock, [(rng.choice(user_ids), rng.choice(tickers), 1) for _ in range(ops)])
+    if holdings:
+        results["sell_stock"] = _time_calls(stock.sell_stock, [rng.choice(holdings) + (1,) for _ in range(ops)])
+    results["get_portfolio"] = _time_calls(stock.get_portfolio, [(rng.choice(user_ids),) for _ in range(ops)])
+    results["calculate_total_assets"] = _time_calls(stock.calculate_total_assets, [(rng.choice(user_ids),) for _ in range(ops)])
+    results["update_stock_prices"] = _time_calls(stock.update_stock_prices, [() for _ in range(ticks)])
+    results["persistence_flush"] = _time_calls(stock._persistence.flush, [()])
+    results["save_users"] = _time_calls(stock.save_users, [()] * saves)
+    results["save_data_stocks"] = _time_calls(stock.save_data, [(stock.STOCK_FILE, stock.stocks.to_dict())] * saves)
+
+    return {
+        "users": user_count,
+        "tickers": ticker_count,
+        "storage": stock.STORAGE_BACKEND,
+        "migrate_seconds": round(migrate_seconds, 3),
+        "load_seconds": round(load_seconds, 3),
+        "resident_users": stock.users.resident_count,
+        "rss_before_load_mb": rss_before,
+        "rss_after_load_mb": rss_after,
+        "rss_peak_mb": _rss_mb(),
+        "ops": results,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_scale(result, baseline=None):
+    print(f"\n[{result['users']:,}명 x {result['tickers']:,}종목, {result['storage']}] "
+          f"첫 로드(요약 생성) {result['migrate_seconds']}초, 로드 {result['load_seconds']}초, 메모리 {result['rss_before_load_mb']} -> {result['rss_after_load_mb']}MB (최대 {result['rss_peak_mb']}MB), "
+          f"캐시에 남은 유저 {result['resident_users']:,}명")
+    for name, summary in result["ops"].items():
+        line = f"  {name:<24} p50 {summary['p50_us']:>11,.1f}us  p99 {summary['p99_us']:>11,.1f}us  (n={summary['n']})"
+        old = (baseline or {}).get("ops", {}).get(name)
+        if old:
+            line += f"  p50 x{summary['p50_us'] / max(old['p50_us'], 1e-9):.2f}, p99 x{summary['p99_us'] / max(old['p99_us'], 1e-9):.2f}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="stock.py 마이크로벤치마크")
+    parser.add_argument("--scales", default=DEFAULT_SCALES, help="'유저수x종목수' 를 쉼표로 구분 (예: 10000x8,1000000x5000)")
+    parser.add_argument("--ops", type=int, default=DEFAULT_OPS)
+    parser.add_argument("--ticks", type=int, default=DEFAULT_TICKS)
+    parser.add_argument("--saves", type=int, default=DEFAULT_SAVES)
+    parser.add_argument("--storage", choices=("json", "sqlite"), default=None, help="STOCK_STORAGE 값 (기본: 환경 변수)")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--out", default="bench_results.json", help="결과 JSON 파일")
+    parser.add_argument("--compare", metavar="PATH", help="이전 결과 JSON 과 비교해 배율을 출력")
+    parser.add_argument("--worker", nargs=2, type=int, metavar=("USERS", "TICKERS"), help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        result = run_scale(args.worker[0], args.worker[1], args.ops, args.ticks, args.saves, args.seed)
+        workdir = os.getcwd()
+        os.chdir(tempfile.gettempdir())
+        shutil.rmtree(workdir, ignore_errors=True)
+        with open(args.result, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        # 저장 스레드가 남은 변경분을 (지워진 폴더에) 쓰지 않도록 바로 종료합니다.
+        os._exit(0)
+
+    baselines = {}
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baselines = {(r["users"], r["tickers"], r["storage"]): r for r in json.load(f)["results"]}
+
+    env = dict(os.environ)
+    if args.storage:
+        env["STOCK_STORAGE"] = args.storage
+    results = []
+    for scale in args.scales.split(","):
+        user_count, ticker_count = (int(part) for part in scale.lower().split("x"))
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+            result_path = f.name
+        # 규모마다 stock 모듈 상태가 섞이지 않도록 새 프로세스에서 측정합니다.
+        subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", str(user_count), str(ticker_count),
+                        "--ops", str(args.ops), "--ticks", str(args.ticks), "--saves", str(args.saves),
+                        "--seed", str(args.seed), "--result", result_path],
+                       env=env, check=True, stdout=subprocess.DEVNULL)
+        with open(result_path, "r", encoding="utf-8") as f:
+            result = json.load(f)
+        os.remove(result_path)
+        print_scale(result, baselines.get((result["users"], result["tickers"], result["storage"])))
+        results.append(result)
+
+    report = {"commit": _git_commit(), "python": sys.version.split()[0],
+              "timestamp": datetime.now().isoformat(timespec="seconds"), "results": results}
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n결과를 {args.out} 에 저장했습니다.")
+
+if __name__ == "__main__":
+    main()
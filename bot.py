@@ -1,18 +1,31 @@
 # bot.py
+import time
+_BOOT_STARTED = time.perf_counter()  # 시작 시간 측정용 (다른 import 보다 먼저)
 import asyncio
 import discord
 from discord.ext import commands, tasks
 import random
+from dotenv import load_dotenv
+# stock 모듈은 import 할 때 .env 설정(STOCK_STORAGE, USER_JOURNAL 등)을 읽으므로 그보다 먼저 불러옵니다.
+load_dotenv()
 import stock
+import voice
+import metrics
 from datetime import datetime
 import os
 import traceback
 import sys
-from dotenv import load_dotenv
+import heapq
+import itertools
+import math
+import threading
+import weakref
+from collections import OrderedDict, deque
+_IMPORTS_DONE = time.perf_counter()
 
 # --- 초기 설정 ---
-load_dotenv()
 TOKEN = os.getenv("DISCORD_TOKEN")
+METRICS_PORT = os.getenv("METRICS_PORT")  # 지정하면 127.0.0.1:<포트>/metrics 로 지표를 제공합니다.
 if not TOKEN:
     print("오류: .env 파일에 DISCORD_TOKEN이 설정되지 않았습니다.", file=sys.stderr)
     exit()
@@ -20,6 +33,17 @@ if not TOKEN:
 # 상수 정의
 PREFIX = "!"
 DAILY_REWARD = 10000
+NAME_CACHE_SIZE = 1000          # 표시 이름 캐시에 보관할 최대 유저 수
+NAME_CACHE_TTL = 60 * 60        # 캐시된 이름의 유효 시간(초)
+NAME_FETCH_CONCURRENCY = 5      # 캐시에 없는 이름을 동시에 조회할 최대 요청 수
+CHART_POINTS = 40               # 주식차트에 그릴 최대 점(봉) 개수
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+EDIT_BUDGET = 5                 # 채널 하나에서 EDIT_WINDOW 초 동안 보낼 메시지 수정 횟수
+EDIT_WINDOW = 5.0
+EDIT_FINAL_RESERVE = 1          # 창마다 마지막 결과 수정용으로 남겨 두는 횟수 (중간 프레임은 쓰지 않음)
+LOOP_HEARTBEAT_INTERVAL = 0.1   # 이벤트 루프 지연을 재는 간격(초)
+LOOP_STALL_THRESHOLD = 0.5      # 이 시간(초) 이상 루프가 멈추면 멈춘 위치를 기록합니다.
+STALL_LOG_SIZE = 20             # 보관할 가장 긴 멈춤 기록 수
 
 # 봇 인텐트 설정
 intents = discord.Intents.default()
@@ -27,6 +51,248 @@ intents.message_content = True
 intents.members = True
 intents.voice_states = True
 
+def render_sparkline(values):
+    """가격 목록을 한 줄짜리 막대 그래프 문자열로 바꿉니다."""
+    low, high = min(values), max(values)
+    if high == low:
+        return SPARK_CHARS[len(SPARK_CHARS) // 2] * len(values)
+    scale = (len(SPARK_CHARS) - 1) / (high - low)
+    return "".join(SPARK_CHARS[round((value - low) * scale)] for value in values)
+
+# --- 표시 이름 캐시 ---
+class DisplayNameCache:
+    """
+    서버에 없는 유저의 표시 이름(user id -> 이름)을 LRU + TTL 방식으로 보관합니다.
+    캐시에 없는 이름은 NAME_FETCH_CONCURRENCY 개까지 동시에 API로 조회합니다.
+    """
+    def __init__(self, bot, max_size=NAME_CACHE_SIZE, ttl=NAME_CACHE_TTL, concurrency=NAME_FETCH_CONCURRENCY):
+        self.bot = bot
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # user_id -> (이름, 만료 시각)
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    def get(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        name, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[user_id]
+            return None
+        self._entries.move_to_end(user_id)
+        return name
+
+    def set(self, user_id, name):
+        self._entries[user_id] = (name, time.monotonic() + self.ttl)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def _fetch(self, user_id, names):
+        async with self._semaphore:
+            try:
+                user = await self.bot.fetch_user(user_id)
+            except (discord.NotFound, discord.HTTPException):
+                return
+        self.set(user_id, user.display_name)
+        names[user_id] = user.display_name
+
+    async def resolve_many(self, guild, user_ids):
+        """여러 유저의 표시 이름을 {user_id: 이름} 으로 돌려줍니다. 찾지 못한 유저는 빠집니다."""
+        names, misses = {}, []
+        for user_id in user_ids:
+            # 서버 멤버는 로컬 캐시에 항상 최신 이름이 있으므로 그대로 씁니다.
+            member = guild.get_member(user_id) if guild else None
+            name = member.display_name if member else self.get(user_id)
+            if name is None:
+                misses.append(user_id)
+            else:
+                names[user_id] = name
+        if misses:
+            await asyncio.gather(*(self._fetch(user_id, names) for user_id in misses))
+        return names
+
+# --- 이벤트 루프 감시 ---
+class LoopWatchdog:
+    """
+    이벤트 루프가 얼마나 늦게 깨어나는지 계속 재고, 오래 멈추면 그 순간 루프 스레드의 스택과
+    실행 중이던 명령어를 기록합니다. 루프가 멈춰 있는 동안에도 확인할 수 있도록 감시는 별도 스레드에서 합니다.
+    """
+    def __init__(self, interval=LOOP_HEARTBEAT_INTERVAL, threshold=LOOP_STALL_THRESHOLD, log_size=STALL_LOG_SIZE):
+        self.interval = interval
+        self.threshold = threshold
+        self.log_size = log_size
+        self.task_commands = weakref.WeakKeyDictionary()  # 작업(Task) -> 실행 중인 명령어 설명
+        self.stalls = []  # (멈춘 시간, 순번, 기록) 최소 힙 - 가장 긴 STALL_LOG_SIZE 개만 남깁니다.
+        self._counter = itertools.count()
+        self._last_beat = time.monotonic()
+        self._pending = None  # 지금 진행 중인 멈춤에 대해 잡아 둔 스택
+        self._loop = None
+        self._loop_thread_id = None
+        self._heartbeat_task = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._heartbeat_task = self._loop.create_task(self._heartbeat())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+
+    def command_started(self, ctx):
+        self.task_commands[asyncio.current_task()] = f"{PREFIX}{ctx.command.qualified_name} ({ctx.author}, #{ctx.channel})"
+
+    def command_finished(self, ctx):
+        self.task_commands.pop(asyncio.current_task(), None)
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self._last_beat = now
+            metrics.LOOP_LAG.observe(lag)
+            if lag >= self.threshold:
+                self._record(lag)
+            else:
+                self._pending = None
+
+    def _watch(self):
+        while not self._stopping.wait(self.interval):
+            # 마지막 박동 뒤 한 번의 대기 시간을 빼야 _heartbeat 가 재는 지연과 같은 기준이 됩니다.
+            stalled_for = time.monotonic() - self._last_beat - self.interval
+            if stalled_for >= self.threshold and self._pending is None:
+                self._pending = self._capture(stalled_for)
+
+    def _capture(self, stalled_for):
+        # 루프 스레드가 지금 실행 중인 프레임과, 그 순간 루프가 돌리던 작업을 잡아 둡니다.
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame else "(스택을 가져오지 못했습니다)"
+        try:
+            task = asyncio.current_task(self._loop)
+        except RuntimeError:
+            task = None
+        command = self.task_commands.get(task) if task else None
+        return {"at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'), "command": command,
+                "task": task.get_name() if task else None, "stack": stack}
+
+    def _record(self, lag):
+        capture, self._pending = self._pending, None
+        if capture is None:
+            return  # 감시 스레드가 스택을 잡기 전에 루프가 돌아온 경우
+        capture["seconds"] = round(lag, 3)
+        metrics.LOOP_STALLS.inc()
+        entry = (lag, next(self._counter), capture)
+        if len(self.stalls) < self.log_size:
+            heapq.heappush(self.stalls, entry)
+        else:
+            heapq.heappushpop(self.stalls, entry)
+        print(f"⚠️ 이벤트 루프가 {lag:.2f}초 동안 멈췄습니다. 명령어: {capture['command'] or '없음'}, 작업: {capture['task']}\n"
+              f"{capture['stack']}", file=sys.stderr)
+
+    def worst(self, limit=STALL_LOG_SIZE):
+        """가장 오래 멈췄던 기록들 (긴 순서)"""
+        return [entry[2] for entry in sorted(self.stalls, reverse=True)[:limit]]
+
+# --- 메시지 수정 스케줄러 ---
+class _ChannelEdits:
+    def __init__(self):
+        self.pending = OrderedDict()  # message id -> (메시지, 수정 내용, 기다리는 future 목록)
+        self.sent = deque()           # 최근 EDIT_WINDOW 초 안에 보낸 수정 시각
+        self.worker = None
+
+    def available(self, now):
+        while self.sent and now - self.sent[0] >= EDIT_WINDOW:
+            self.sent.popleft()
+        return EDIT_BUDGET - len(self.sent)
+
+    def idle(self, now):
+        """보낼 수정도 없고 최근 창에 보낸 기록도 없으면 True. (지워도 속도 제한이 어긋나지 않음)"""
+        return not self.pending and (self.worker is None or self.worker.done()) and self.available(now) == EDIT_BUDGET
+
+
+class EditScheduler:
+    """
+    애니메이션 임베드의 message.edit 을 채널별로 모아서 보냅니다.
+    - 같은 메시지에 아직 보내지 못한 수정이 있으면 마지막 내용으로 덮어써서 한 번만 보냅니다.
+    - 채널마다 EDIT_WINDOW 초에 EDIT_BUDGET 번까지만 보내고, 대기 중인 메시지들은 차례대로 돌아가며 보냅니다.
+    - frame() 으로 넣은 중간 프레임은 채널이 바쁘면 줄 세우지 않고 버립니다. edit() 은 반드시 보냅니다.
+    - 창마다 EDIT_FINAL_RESERVE 번은 edit() 용으로 남겨 두어, 혼자 쓰는 채널에서 마지막 결과가 창이 끝날 때까지 밀리지 않게 합니다.
+    """
+    PRUNE_EVERY = 100  # 새 채널이 이만큼 생길 때마다 한동안 쓰지 않은 채널 기록을 지웁니다.
+
+    def __init__(self):
+        self._channels = {}
+        self._created = 0
+
+    def _channel(self, message):
+        channel = self._channels.get(message.channel.id)
+        if channel is None:
+            self._created += 1
+            if self._created % self.PRUNE_EVERY == 0:
+                self._prune(time.monotonic())
+            channel = self._channels[message.channel.id] = _ChannelEdits()
+        return channel
+
+    def _prune(self, now):
+        for channel_id in [channel_id for channel_id, channel in self._channels.items() if channel.idle(now)]:
+            del self._channels[channel_id]
+
+    def frame(self, message, **fields):
+        """버려져도 되는 애니메이션 프레임. 채널에 여유가 없어 버렸으면 False."""
+        channel = self._channel(message)
+        room = channel.available(time.monotonic()) - EDIT_FINAL_RESERVE
+        if message.id not in channel.pending and len(channel.pending) >= room:
+            return False
+        self._submit(channel, message, fields)
+        return True
+
+    async def edit(self, message, **fields):
+        """마지막 프레임처럼 반드시 반영되어야 하는 수정. 실제로 보내질 때까지 기다립니다."""
+        future = asyncio.get_running_loop().create_future()
+        self._submit(self._channel(message), message, fields, future)
+        await future
+
+    def _submit(self, channel, message, fields, future=None):
+        entry = channel.pending.get(message.id)
+        waiters = entry[2] if entry else []
+        if future is not None:
+            waiters.append(future)
+        channel.pending[message.id] = (message, fields, waiters)
+        if channel.worker is None or channel.worker.done():
+            channel.worker = asyncio.get_running_loop().create_task(self._run(channel))
+
+    async def _run(self, channel):
+        while channel.pending:
+            now = time.monotonic()
+            available = channel.available(now)
+            if available <= EDIT_FINAL_RESERVE:
+                # 남은 자리는 마지막 결과용이라, 기다리는 쪽이 없는 중간 프레임은 보내지 않고 버립니다.
+                for message_id in [message_id for message_id, entry in channel.pending.items() if not entry[2]]:
+                    del channel.pending[message_id]
+                if not channel.pending:
+                    break
+            if available <= 0:
+                await asyncio.sleep(EDIT_WINDOW - (now - channel.sent[0]))
+                continue
+            _, (message, fields, waiters) = channel.pending.popitem(last=False)
+            channel.sent.append(now)
+            try:
+                await message.edit(**fields)
+            except discord.HTTPException as e:
+                for future in waiters:
+                    if not future.done(): future.set_exception(e)
+                continue
+            for future in waiters:
+                if not future.done(): future.set_result(None)
+
 # --- 주식 및 기타 기능 Cog ---
 class General(commands.Cog, name="주식"):
     """
@@ -34,6 +300,69 @@ class General(commands.Cog, name="주식"):
     """
     def __init__(self, bot):
         self.bot = bot
+        self.name_cache = DisplayNameCache(bot)
+        self.edits = EditScheduler()
+        self._embed_cache = {}  # 키 -> (시장 버전, 임베드)
+
+    @commands.Cog.listener()
+    async def on_user_update(self, before: discord.User, after: discord.User):
+        if self.name_cache.get(after.id) is not None:
+            self.name_cache.set(after.id, after.display_name)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        # 서버를 나간 멤버는 이후 랭킹에서 API 조회가 필요하므로 전역 이름을 미리 넣어 둡니다.
+        self.name_cache.set(member.id, member.global_name or member.name)
+
+    def _cached_embed(self, key, build):
+        """시장 버전이 그대로면 캐시된 임베드를, 바뀌었으면 build()로 새로 만든 임베드를 돌려줍니다."""
+        version = stock.get_market_version()
+        cached = self._embed_cache.get(key)
+        if cached and cached[0] == version:
+            return cached[1]
+        embed = build()
+        self._embed_cache[key] = (version, embed)
+        return embed
+
+    def _build_stock_list_embed(self):
+        # [설명] 임베드 기본 틀 생성. 제목, 설명, 색상, 타임스탬프를 설정하여 더 많은 정보 제공
+        embed = discord.Embed(
+            title="📈 실시간 주식 시세 표 📈",
+            description="현재 상장된 주식 목록과 변동률입니다.",
+            color=discord.Color.blue(),
+            timestamp=datetime.now() # [설명] 정보 업데이트 시점을 알려주는 타임스탬프 추가
+        )
+
+        # [설명] 각 정보를 리스트로 만들어 컬럼(열)처럼 보이게 구성
+        stock_names = []
+        stock_prices = []
+        stock_changes_str = []
+            
+        # [설명] stock.stocks가 {'이름': {'price': 가격, ...}} 형태일 것을 가정하고 수정
+        for name, data in stock.stocks.items():
+            price = data.get('price', 0) # [설명] data 딕셔너리에서 'price' 키로 가격을 가져옵니다.
+            _, percent_change = stock.stock_changes.get(name, (0, 0))
+                
+            symbol = "🔺" if percent_change > 0 else ("🔻" if percent_change < 0 else "➖")
+                
+            stock_names.append(f"**{name}**")
+            stock_prices.append(f"`${price:,.2f}`") # [설명] 가격을 코드 블록(`)으로 감싸 가독성 향상
+            stock_changes_str.append(f"`{symbol} {percent_change:+.2f}%`") # [설명] 변동률도 코드 블록으로 감싸 정렬 효과
+
+        # [설명] 준비된 리스트들을 'inline=True' 필드로 추가하여 표 형태로 만듭니다.
+        embed.add_field(name="종목명", value="\n".join(stock_names), inline=True)
+        embed.add_field(name="현재가", value="\n".join(stock_prices), inline=True)
+        embed.add_field(name="변동률", value="\n".join(stock_changes_str), inline=True)
+
+        # [설명] 진행 중인 시장 이벤트와 남은 시간을 함께 보여줍니다.
+        events = stock.get_active_events()
+        if events:
+            event_lines = [f"{'🏢' if e['target_type'] == 'sector' else '📌'} **{e['target']}** `x{e['multiplier']:.3f}` (<t:{int(e['expires'])}:R> 종료)" for e in events]
+            embed.add_field(name="📰 시장 이벤트", value="\n".join(event_lines), inline=False)
+
+        # [설명] 추가적인 명령어 안내를 footer에 추가하여 사용자 편의성 증진
+        embed.set_footer(text="자세한 정보는 !주식정보 <종목명> 을 입력하세요.")
+        return embed
 
     # ⭐ [수정] 가독성과 정보량을 개선한 새로운 주식목록 명령어
     @commands.command(name='주식목록', aliases=['주식'])
@@ -45,37 +374,8 @@ class General(commands.Cog, name="주식"):
                 await ctx.send("표시할 주식 정보가 없습니다.")
                 return
 
-            # [설명] 임베드 기본 틀 생성. 제목, 설명, 색상, 타임스탬프를 설정하여 더 많은 정보 제공
-            embed = discord.Embed(
-                title="📈 실시간 주식 시세 표 📈",
-                description="현재 상장된 주식 목록과 변동률입니다.",
-                color=discord.Color.blue(),
-                timestamp=datetime.now() # [설명] 정보 업데이트 시점을 알려주는 타임스탬프 추가
-            )
-
-            # [설명] 각 정보를 리스트로 만들어 컬럼(열)처럼 보이게 구성
-            stock_names = []
-            stock_prices = []
-            stock_changes_str = []
-            
-            # [설명] stock.stocks가 {'이름': {'price': 가격, ...}} 형태일 것을 가정하고 수정
-            for name, data in stock.stocks.items():
-                price = data.get('price', 0) # [설명] data 딕셔너리에서 'price' 키로 가격을 가져옵니다.
-                _, percent_change = stock.stock_changes.get(name, (0, 0))
-                
-                symbol = "🔺" if percent_change > 0 else ("🔻" if percent_change < 0 else "➖")
-                
-                stock_names.append(f"**{name}**")
-                stock_prices.append(f"`${price:,.2f}`") # [설명] 가격을 코드 블록(`)으로 감싸 가독성 향상
-                stock_changes_str.append(f"`{symbol} {percent_change:+.2f}%`") # [설명] 변동률도 코드 블록으로 감싸 정렬 효과
-
-            # [설명] 준비된 리스트들을 'inline=True' 필드로 추가하여 표 형태로 만듭니다.
-            embed.add_field(name="종목명", value="\n".join(stock_names), inline=True)
-            embed.add_field(name="현재가", value="\n".join(stock_prices), inline=True)
-            embed.add_field(name="변동률", value="\n".join(stock_changes_str), inline=True)
-
-            # [설명] 추가적인 명령어 안내를 footer에 추가하여 사용자 편의성 증진
-            embed.set_footer(text="자세한 정보는 !주식정보 <종목명> 을 입력하세요.")
+            # [설명] 시세가 바뀌지 않았다면 이전에 만든 임베드를 그대로 재사용합니다.
+            embed = self._cached_embed("주식목록", self._build_stock_list_embed)
 
             await ctx.send(embed=embed)
         except Exception as e:
@@ -90,6 +390,10 @@ class General(commands.Cog, name="주식"):
         if stock_name not in stock.stocks:
             return await ctx.send("❌ 존재하지 않는 종목입니다.")
         
+        embed = self._cached_embed(("주식정보", stock_name), lambda: self._build_stock_info_embed(stock_name))
+        await ctx.send(embed=embed)
+
+    def _build_stock_info_embed(self, stock_name):
         data = stock.stocks[stock_name]
         embed = discord.Embed(title=f"📊 {stock_name} 상세 정보", color=discord.Color.blue())
         embed.add_field(name="현재가", value=f"`${data['price']:,.2f}`", inline=True)
@@ -97,7 +401,40 @@ class General(commands.Cog, name="주식"):
         embed.add_field(name="안정성 지수", value=data['volatility'], inline=True)
         embed.add_field(name="총 발행량", value=f"{data['total_shares']:,}주", inline=True)
         embed.add_field(name="현재 유통량", value=f"{data['available_shares']:,}주", inline=True)
-        
+        return embed
+
+    @commands.command(name='주식차트', aliases=['차트'])
+    async def stock_chart(self, ctx: commands.Context, stock_name: str, interval: str = "1h"):
+        """종목의 가격 흐름을 보여줍니다. 간격은 1m(틱), 1h, 1d 중에서 고를 수 있습니다."""
+        if stock_name not in stock.stocks:
+            return await ctx.send("❌ 존재하지 않는 종목입니다.")
+
+        if interval == "1m":
+            candles = [(ts, price, price, price, price) for ts, price in stock.get_price_history(stock_name, CHART_POINTS)]
+        elif interval in stock.CANDLE_INTERVALS:
+            candles = stock.get_candles(stock_name, interval, CHART_POINTS)
+        else:
+            return await ctx.send("❌ 간격은 `1m`, `1h`, `1d` 중 하나를 입력해주세요.")
+        if not candles:
+            return await ctx.send("📭 아직 기록된 시세가 없습니다.")
+
+        first_open, last_close = candles[0][1], candles[-1][4]
+        change_percent = (last_close - first_open) / first_open * 100 if first_open else 0
+        embed = discord.Embed(title=f"📉 {stock_name} 차트 ({interval})", color=discord.Color.blue())
+        embed.add_field(name="가격 흐름", value=f"```\n{render_sparkline([c[4] for c in candles])}\n```", inline=False)
+        embed.add_field(name="시작가", value=f"`${first_open:,.2f}`", inline=True)
+        embed.add_field(name="현재가", value=f"`${last_close:,.2f}`", inline=True)
+        embed.add_field(name="변동률", value=f"`{change_percent:+.2f}%`", inline=True)
+        embed.add_field(name="최고가", value=f"`${max(c[2] for c in candles):,.2f}`", inline=True)
+        embed.add_field(name="최저가", value=f"`${min(c[3] for c in candles):,.2f}`", inline=True)
+
+        if interval != "1m":
+            time_format = "%m-%d" if interval == "1d" else "%m-%d %H시"
+            rows = [f"{datetime.fromtimestamp(ts).strftime(time_format):<9} | {o:>8.2f} | {h:>8.2f} | {l:>8.2f} | {c:>8.2f}"
+                    for ts, o, h, l, c in candles[-5:]]
+            header = f"{'시간':<8} | {'시가':>7} | {'고가':>7} | {'저가':>7} | {'종가':>7}"
+            embed.add_field(name="최근 봉", value="```\n" + header + "\n" + "\n".join(rows) + "\n```", inline=False)
+        embed.set_footer(text=f"최근 {len(candles)}개 구간 기준")
         await ctx.send(embed=embed)
 
     @commands.command(name='주식구매')
@@ -109,7 +446,8 @@ class General(commands.Cog, name="주식"):
         try: amount = "all" if amount_str.lower() == "all" else int(amount_str)
         except ValueError: return await ctx.send("❌ 유효한 수량을 입력해주세요.")
 
-        success, result = stock.buy_stock(user_id, stock_name, amount)
+        # 거래는 유저/종목 단위로 잠기므로 이벤트 루프를 막지 않도록 워커 스레드에서 처리합니다.
+        success, result = await self.bot.loop.run_in_executor(None, stock.buy_stock, user_id, stock_name, amount)
         
         if success:
             embed = discord.Embed(title="✅ 주식 구매 완료", color=discord.Color.green())
@@ -131,7 +469,7 @@ class General(commands.Cog, name="주식"):
         try: amount_to_sell = "all" if amount_str.lower() == 'all' else int(amount_str)
         except ValueError: return await ctx.send("❌ 유효한 수량을 입력해주세요.")
 
-        success, result = stock.sell_stock(user_id, stock_name, amount_to_sell)
+        success, result = await self.bot.loop.run_in_executor(None, stock.sell_stock, user_id, stock_name, amount_to_sell)
         if success:
             embed = discord.Embed(title="✅ 주식 판매 완료", color=discord.Color.blue())
             embed.add_field(name="종목", value=stock_name, inline=True)
@@ -143,39 +481,89 @@ class General(commands.Cog, name="주식"):
             await ctx.send(embed=embed)
         else: await ctx.send(f"❌ 판매 실패: {result}")
 
+    async def _place_limit_order(self, ctx: commands.Context, side: str, stock_name: str, amount_str: str, price_str: str):
+        if not amount_str.isdigit() or int(amount_str) <= 0:
+            return await ctx.send("❌ 수량은 0보다 큰 숫자여야 합니다.")
+        try: limit_price = float(price_str)
+        except ValueError: return await ctx.send("❌ 유효한 가격을 입력해주세요.")
+        if not math.isfinite(limit_price):
+            return await ctx.send("❌ 유효한 가격을 입력해주세요.")
+
+        success, result = await self.bot.loop.run_in_executor(None, stock.place_limit_order, str(ctx.author.id), stock_name, side, int(amount_str), limit_price)
+        if not success:
+            return await ctx.send(f"❌ 주문 실패: {result}")
+
+        embed = discord.Embed(title=f"📝 지정가 {'매수' if side == 'buy' else '매도'} 주문 접수", color=discord.Color.orange())
+        embed.add_field(name="주문번호", value=f"`#{result['order_id']}`", inline=True)
+        embed.add_field(name="종목", value=stock_name, inline=True)
+        embed.add_field(name="수량", value=f"{result['quantity']}주", inline=True)
+        embed.add_field(name="지정가", value=f"`${result['limit']:,.2f}`", inline=True)
+        if side == "buy":
+            embed.add_field(name="예약 금액 (수수료 포함)", value=f"`${result['reserved']:,.2f}`", inline=True)
+        embed.set_footer(text="매 시세 갱신마다 지정가에 닿으면 현재가로 체결됩니다. 취소: !주문취소 <주문번호>")
+        await ctx.send(embed=embed)
+
+    @commands.command(name='지정가매수')
+    async def limit_buy(self, ctx: commands.Context, stock_name: str, amount_str: str, price_str: str):
+        """현재가가 지정한 가격 이하가 되면 매수하는 주문을 넣습니다."""
+        await self._place_limit_order(ctx, "buy", stock_name, amount_str, price_str)
+
+    @commands.command(name='지정가매도')
+    async def limit_sell(self, ctx: commands.Context, stock_name: str, amount_str: str, price_str: str):
+        """현재가가 지정한 가격 이상이 되면 매도하는 주문을 넣습니다."""
+        await self._place_limit_order(ctx, "sell", stock_name, amount_str, price_str)
+
+    @commands.command(name='주문취소')
+    async def cancel_order(self, ctx: commands.Context, order_id: str):
+        """대기 중인 지정가 주문을 취소하고 묶여 있던 현금/주식을 돌려받습니다."""
+        success, result = await self.bot.loop.run_in_executor(None, stock.cancel_limit_order, str(ctx.author.id), order_id.lstrip('#'))
+        if not success:
+            return await ctx.send(result)
+        await ctx.send(f"🗑️ 주문 `#{order_id.lstrip('#')}` ({result['stock']} {result['quantity']}주 {'매수' if result['side'] == 'buy' else '매도'})을 취소했습니다.")
+
+    @commands.command(name='내주문', aliases=['주문목록'])
+    async def my_orders(self, ctx: commands.Context):
+        """대기 중인 지정가 주문 목록을 보여줍니다."""
+        orders = await self.bot.loop.run_in_executor(None, stock.get_open_orders, str(ctx.author.id))
+        if not orders:
+            return await ctx.send("📭 대기 중인 지정가 주문이 없습니다.")
+        lines = [f"`#{order_id}` {'🟢 매수' if order['side'] == 'buy' else '🔴 매도'} **{order['stock']}** {order['quantity']}주 @ `${order['limit']:,.2f}`"
+                 for order_id, order in orders[:20]]
+        embed = discord.Embed(title=f"📝 {ctx.author.display_name}님의 대기 주문", description="\n".join(lines), color=discord.Color.orange())
+        if len(orders) > 20:
+            embed.set_footer(text=f"... 외 {len(orders) - 20}건")
+        await ctx.send(embed=embed)
+
     @commands.command(name='내자산', aliases=['내주식', '나', '포트폴리오'])
     async def my_assets(self, ctx: commands.Context):
-        result_text = stock.get_portfolio(str(ctx.author.id))
+        result_text = await self.bot.loop.run_in_executor(None, stock.get_portfolio, str(ctx.author.id))
         embed = discord.Embed(title=f"💰 {ctx.author.display_name}님의 자산 현황", description=result_text, color=discord.Color.purple())
         await ctx.send(embed=embed)
 
     @commands.command(name="랭킹")
     async def ranking(self, ctx: commands.Context):
-        users = stock.load_users()
-        if not users: return await ctx.send("📊 아직 등록된 사용자가 없습니다!")
-        ranking_list = sorted([(uid, stock.calculate_total_assets(uid)) for uid in users], key=lambda x: x[1], reverse=True)
-        top_users = ranking_list[:10]
+        top_users = await self.bot.loop.run_in_executor(None, stock.get_leaderboard, 10)
+        if not top_users: return await ctx.send("📊 아직 등록된 사용자가 없습니다!")
         embed = discord.Embed(title="🏆 주식왕 랭킹 🏆", description="*총 자산 = 현금 + 보유 주식 가치*", color=0xFFD700)
         rank_emojis = ["🥇", "🥈", "🥉"]
         text_lines = []
+        names = await self.name_cache.resolve_many(ctx.guild, [int(uid) for uid, _ in top_users])
         for i, (uid, assets) in enumerate(top_users):
-            try:
-                member = ctx.guild.get_member(int(uid)) or await self.bot.fetch_user(int(uid))
-                name, emoji = member.display_name, rank_emojis[i] if i < 3 else f'**{i+1}위**'
-                text_lines.append(f"{emoji} {name} - `₩{assets:,.0f}`")
-            except (discord.NotFound, discord.HTTPException): continue
+            if int(uid) not in names: continue
+            name, emoji = names[int(uid)], rank_emojis[i] if i < 3 else f'**{i+1}위**'
+            text_lines.append(f"{emoji} {name} - `₩{assets:,.0f}`")
         embed.description = "\n".join(text_lines) or "랭킹 정보 없음"
-        try:
-            user_rank = next(i + 1 for i, (uid, _) in enumerate(ranking_list) if uid == str(ctx.author.id))
+        user_rank = await self.bot.loop.run_in_executor(None, stock.get_user_rank, str(ctx.author.id))
+        if user_rank:
             embed.set_footer(text=f"{ctx.author.display_name}님의 현재 순위: {user_rank}위")
-        except StopIteration:
+        else:
             embed.set_footer(text=f"{ctx.author.display_name}님은 아직 랭킹에 없습니다.")
         await ctx.send(embed=embed)
 
     @commands.command(name='출석')
     async def daily_claim(self, ctx: commands.Context):
         user_id = str(ctx.author.id)
-        success, result = stock.claim_daily(user_id, DAILY_REWARD)
+        success, result = await self.bot.loop.run_in_executor(None, stock.claim_daily, user_id, DAILY_REWARD)
         if success:
             await ctx.send(f"✅ {ctx.author.display_name}님, 출석 완료! **{DAILY_REWARD:,}원**이 지급되었습니다.\n현재 잔액: `${result['new_balance']:,.2f}`")
         else:
@@ -260,64 +648,57 @@ class General(commands.Cog, name="주식"):
 
         # --- 슬롯 머신 ---
         if game_type == "슬롯":
-            success, result = stock.process_slot_machine(user_id, bet_amount_str)
+            success, result = await self.bot.loop.run_in_executor(None, stock.process_slot_machine, user_id, bet_amount_str)
             if not success:
                 return await ctx.send(f"❌ 슬롯머신 실패: {result['message']}")
             
+            # 음성 연결은 음악 Cog 와 함께 쓰며, 끝난 뒤에도 잠시 유지해서 다음 판에 다시 연결하지 않습니다.
             voice_client = None
             if ctx.author.voice and ctx.author.voice.channel:
-                if ctx.voice_client: voice_client = await ctx.voice_client.move_to(ctx.author.voice.channel)
-                else: voice_client = await ctx.author.voice.channel.connect()
+                voice_client = await voice.voice_manager.connect(ctx.author.voice.channel)
 
-            try:
-                emojis = ['💎', '💰', '7️⃣', '🍒', '💔']
-                embed = discord.Embed(title="🎰 슬롯머신 🎰", description="릴이 돌아갑니다...", color=discord.Color.light_grey())
-                embed.set_author(name=ctx.author.display_name, icon_url=ctx.author.avatar.url if ctx.author.avatar else None)
-                embed.add_field(name="결과", value="[ ❓ | ❓ | ❓ ]", inline=False)
-                message = await ctx.send(embed=embed)
-                if voice_client: voice_client.play(discord.FFmpegPCMAudio(os.path.join('sounds', 'spin.mp3')))
-                
+            emojis = ['💎', '💰', '7️⃣', '🍒', '💔']
+            embed = discord.Embed(title="🎰 슬롯머신 🎰", description="릴이 돌아갑니다...", color=discord.Color.light_grey())
+            embed.set_author(name=ctx.author.display_name, icon_url=ctx.author.avatar.url if ctx.author.avatar else None)
+            embed.add_field(name="결과", value="[ ❓ | ❓ | ❓ ]", inline=False)
+            message = await ctx.send(embed=embed)
+            if voice_client: voice.voice_manager.play_effect(ctx.guild, 'spin')
+            
+            await asyncio.sleep(1)
+            for _ in range(2):
+                spinning_reels = [random.choice(emojis) for _ in range(3)]
+                embed.set_field_at(0, name="결과", value=f"[ {spinning_reels[0]} | {spinning_reels[1]} | {spinning_reels[2]} ]", inline=False)
+                self.edits.frame(message, embed=embed.copy())
+                await asyncio.sleep(0.7)
+
+            final_reels = result['reels']
+            revealed_reels = ["❓", "❓", "❓"]
+            for i in range(3):
+                revealed_reels[i] = final_reels[i]
+                embed.set_field_at(0, name="결과", value=f"[ {revealed_reels[0]} | {revealed_reels[1]} | {revealed_reels[2]} ]", inline=False)
+                self.edits.frame(message, embed=embed.copy())
                 await asyncio.sleep(1)
-                for _ in range(2):
-                    spinning_reels = [random.choice(emojis) for _ in range(3)]
-                    embed.set_field_at(0, name="결과", value=f"[ {spinning_reels[0]} | {spinning_reels[1]} | {spinning_reels[2]} ]", inline=False)
-                    await message.edit(embed=embed)
-                    await asyncio.sleep(0.7)
-
-                final_reels = result['reels']
-                revealed_reels = ["❓", "❓", "❓"]
-                for i in range(3):
-                    revealed_reels[i] = final_reels[i]
-                    embed.set_field_at(0, name="결과", value=f"[ {revealed_reels[0]} | {revealed_reels[1]} | {revealed_reels[2]} ]", inline=False)
-                    await message.edit(embed=embed)
-                    await asyncio.sleep(1)
-                
-                while voice_client and voice_client.is_playing(): await asyncio.sleep(0.1)
-                
-                if result['winnings'] > result['bet_amount']:
-                    embed.description = f"🎉 **축하합니다! `{result['winnings'] - result['bet_amount']:,.0f}원` 획득!** 🎉"
-                    embed.color = discord.Color.green()
-                    if voice_client: voice_client.play(discord.FFmpegPCMAudio(os.path.join('sounds', 'win.mp3')))
-                elif result['winnings'] > 0:
-                    embed.description = f"🎉 **본전입니다! `{result['bet_amount']:,.0f}원`을 돌려받았습니다!** 🎉"
-                    embed.color = discord.Color.blue()
-                else:
-                    embed.description = f"💸 **아쉽네요... `{result['bet_amount']:,.0f}원`을 잃었습니다.** 💸"
-                    embed.color = discord.Color.red()
-                    if voice_client: voice_client.play(discord.FFmpegPCMAudio(os.path.join('sounds', 'lose.mp3')))
+            
+            if voice_client: await voice.voice_manager.wait_effects(ctx.guild)
+            
+            if result['winnings'] > result['bet_amount']:
+                embed.description = f"🎉 **축하합니다! `{result['winnings'] - result['bet_amount']:,.0f}원` 획득!** 🎉"
+                embed.color = discord.Color.green()
+                if voice_client: voice.voice_manager.play_effect(ctx.guild, 'win')
+            elif result['winnings'] > 0:
+                embed.description = f"🎉 **본전입니다! `{result['bet_amount']:,.0f}원`을 돌려받았습니다!** 🎉"
+                embed.color = discord.Color.blue()
+            else:
+                embed.description = f"💸 **아쉽네요... `{result['bet_amount']:,.0f}원`을 잃었습니다.** 💸"
+                embed.color = discord.Color.red()
+                if voice_client: voice.voice_manager.play_effect(ctx.guild, 'lose')
 
-                embed.add_field(name="현재 잔액", value=f"`${result['new_balance']:,.2f}`", inline=False)
-                await message.edit(embed=embed)
-                
-            finally:
-                if voice_client:
-                    while voice_client.is_playing(): await asyncio.sleep(0.1)
-                    await asyncio.sleep(1)
-                    await voice_client.disconnect()
-        
+            embed.add_field(name="현재 잔액", value=f"`${result['new_balance']:,.2f}`", inline=False)
+            await self.edits.edit(message, embed=embed)
+    
         # --- 주사위 게임 ---
         elif game_type == "주사위":
-            success, result = stock.process_dice_roll(user_id, bet_amount_str)
+            success, result = await self.bot.loop.run_in_executor(None, stock.process_dice_roll, user_id, bet_amount_str)
             if not success:
                 return await ctx.send(f"❌ 주사위 게임 실패: {result['message']}")
 
@@ -340,7 +721,7 @@ class General(commands.Cog, name="주식"):
         # --- 동전던지기 게임 ---
         elif game_type == "동전":
             if not choice: return await ctx.send("❌ 사용법: `!도박 동전 <앞/뒤> <금액>`")
-            success, result = stock.process_coin_flip(user_id, bet_amount_str, choice)
+            success, result = await self.bot.loop.run_in_executor(None, stock.process_coin_flip, user_id, bet_amount_str, choice)
             if not success:
                 return await ctx.send(f"❌ 동전던지기 실패: {result['message']}")
 
@@ -375,7 +756,7 @@ class General(commands.Cog, name="주식"):
     async def help_command(self, ctx: commands.Context):
         embed = discord.Embed(title="📜 봇 도움말", description=f"명령어 접두사는 `{PREFIX}` 입니다.", color=0x5865F2)
         embed.add_field(name="🎵 음악 명령어", value="`들어와`, `나가`, `불러봐`, `검색`, `대기열`, `스킵`, `일시정지`, `재개`, `현재곡`, `반복`, `한곡반복`", inline=False)
-        embed.add_field(name="💹 주식 명령어", value="`주식목록`, `주식정보`, `주식구매`, `주식판매`, `내자산`, `랭킹`, `출석`", inline=False)
+        embed.add_field(name="💹 주식 명령어", value="`주식목록`, `주식정보`, `주식차트`, `주식구매`, `주식판매`, `지정가매수`, `지정가매도`, `주문취소`, `내주문`, `내자산`, `랭킹`, `출석`", inline=False)
         embed.add_field(name="🎲 도박 및 기타", value="`도박`, `도움말`, `제비뽑기`\n(`!도박`을 입력하여 게임 종류를 확인하세요!)", inline=False)
         await ctx.send(embed=embed)
 
@@ -384,11 +765,48 @@ class General(commands.Cog, name="주식"):
 class StockBot(commands.Bot):
     def __init__(self):
         super().__init__(command_prefix=PREFIX, intents=intents, help_command=None)
-
-    async def setup_hook(self):
-        await self.add_cog(General(self))
-        print("🔧 'General' Cog를 로드했습니다.")
+        self.metrics_runner = None
+        self.watchdog = LoopWatchdog()
+        self.startup_phases = [("모듈 import", _IMPORTS_DONE - _BOOT_STARTED),
+                               ("  └ 그중 주식 데이터 로드", stock.DATA_LOAD_SECONDS)]
+        self._startup_reported = False
+        self._setup_done = _IMPORTS_DONE
+        # 모든 Cog 의 명령어에 공통으로 적용되는 전/후 훅에서 처리 시간을 기록합니다. 오류 수는 on_command_error 에서 셉니다.
+        self.before_invoke(self._command_started)
+        self.after_invoke(self._command_finished)
+
+    @staticmethod
+    def _command_labels(ctx):
+        return {"cog": ctx.cog.qualified_name if ctx.cog else "", "command": ctx.command.qualified_name}
+
+    async def _command_started(self, ctx: commands.Context):
+        ctx.metrics_started = time.perf_counter()
+        metrics.COMMANDS_IN_FLIGHT.inc(**self._command_labels(ctx))
+        self.watchdog.command_started(ctx)
+
+    async def _command_finished(self, ctx: commands.Context):
+        # 명령어가 오류로 끝나도 호출됩니다. (전 훅보다 먼저 실패한 경우는 시작 시각이 없습니다)
+        started = getattr(ctx, "metrics_started", None)
+        if started is None:
+            return
+        self.watchdog.command_finished(ctx)
+        labels = self._command_labels(ctx)
+        metrics.COMMANDS_IN_FLIGHT.dec(**labels)
+        metrics.COMMAND_DURATION.observe(time.perf_counter() - started, **labels)
+
+    def _phase(self, name, started):
+        now = time.perf_counter()
+        self.startup_phases.append((name, now - started))
+        return now
+
+    async def load_music(self):
+        """
+        music 확장을 로그인 전에 불러옵니다. 프로세스 추출 모드의 워커는 fork 로 뜨는데, 로그인 뒤(setup_hook)에는
+        이벤트 루프 실행기에 주소 조회 스레드가 이미 있을 수 있어서, 봇이 아무 스레드도 만들기 전에 불러와야 합니다.
+        """
+        started = time.perf_counter()
         try:
+            # yt-dlp 는 여기서 불러오지 않고 on_ready 뒤에 백그라운드로 준비합니다.
             await self.load_extension('music')
             print("🎵 'music' Cog를 로드했습니다.")
         except commands.ExtensionNotFound:
@@ -396,21 +814,57 @@ class StockBot(commands.Bot):
         except Exception as e:
             print(f"music Cog 로드 중 오류 발생: {e}", file=sys.stderr)
             traceback.print_exc()
+        self._phase("music Cog", started)
+
+    async def setup_hook(self):
+        started = time.perf_counter()
+        self.watchdog.start()
+        stock.start_persistence()
+        if METRICS_PORT:
+            self.metrics_runner = await metrics.start_server(int(METRICS_PORT))
+        started = self._phase("저장 스레드/지표 서버", started)
+        await self.loop.run_in_executor(None, voice.sound_bank.load)
+        started = self._phase("효과음 디코딩", started)
+        await self.add_cog(General(self))
+        print("🔧 'General' Cog를 로드했습니다.")
+        started = self._phase("General Cog", started)
         self.auto_update_stock.start()
+        self._setup_done = started
 
     @tasks.loop(minutes=1)
     async def auto_update_stock(self):
-        stock.update_stock_prices()
+        started = time.perf_counter()
+        await self.loop.run_in_executor(None, stock.update_stock_prices)
+        # 새 시세에 닿은 지정가 주문을 한꺼번에 체결합니다.
+        await self.loop.run_in_executor(None, stock.match_limit_orders)
+        metrics.TICK_DURATION.observe(time.perf_counter() - started)
 
     @auto_update_stock.before_loop
     async def before_auto_update_stock(self):
         await self.wait_until_ready()
 
+    async def close(self):
+        self.watchdog.stop()
+        await metrics.stop_server(self.metrics_runner)
+        await super().close()
+        # 저장 대기 중인 변경분을 모두 기록한 뒤 종료합니다.
+        stock.stop_persistence()
+        print("💾 데이터를 저장했습니다.")
+
     async def on_ready(self):
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 봇이 준비되었습니다: {self.user}")
+        if not self._startup_reported:
+            self._startup_reported = True
+            self._phase("로그인 및 서버 정보 수신", self._setup_done)
+            print(f"⏱️ 시작 시간 {time.perf_counter() - _BOOT_STARTED:.2f}초")
+            for name, seconds in self.startup_phases:
+                print(f"   {name}: {seconds:.2f}초")
         await self.change_presence(status=discord.Status.online, activity=discord.Game(f"{PREFIX}도움말"))
 
     async def on_command_error(self, ctx: commands.Context, error: commands.CommandError):
+        # 잘못된 인자, 검사 실패, 쿨다운처럼 전 훅보다 먼저 실패한 경우도 여기서 함께 셉니다.
+        if ctx.command is not None:
+            metrics.COMMAND_ERRORS.inc(**self._command_labels(ctx))
         if hasattr(ctx.command, 'on_error'): return
         if isinstance(error, commands.CommandNotFound): return
         
@@ -424,7 +878,9 @@ class StockBot(commands.Bot):
 # --- 봇 실행 ---
 async def main():
     bot = StockBot()
-    await bot.start(TOKEN)
+    async with bot:
+        await bot.load_music()
+        await bot.start(TOKEN)
 
 if __name__ == "__main__":
     try:
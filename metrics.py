@@ -0,0 +1,150 @@
+# metrics.py
+# 명령어 지연 시간, 오류 수, 저장/시세 갱신 시간 등을 모아 Prometheus 텍스트 형식으로 보여줍니다.
+# .env 에 METRICS_PORT=9100 처럼 포트를 지정하면 http://127.0.0.1:9100/metrics 로 확인할 수 있습니다.
+import bisect
+import sys
+import threading
+
+# 초 단위 히스토그램 구간 (마지막은 +Inf)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escape = lambda v: str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # 라벨 값 튜플 -> 값
+        self._lock = threading.Lock()  # 저장 스레드 등 이벤트 루프 밖에서도 기록합니다.
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # [구간별 개수..., +Inf 개수], 합계
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def _render_sample(self, key, value):
+        counts, total = value
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', le)])} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+        lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+REGISTRY = []
+
+def render():
+    """등록된 모든 지표를 Prometheus 텍스트 형식으로 돌려줍니다."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- 지표 정의 ---
+COMMAND_DURATION = Histogram("bot_command_duration_seconds", "명령어 처리 시간", ("cog", "command"))
+COMMAND_ERRORS = Counter("bot_command_errors_total", "오류로 끝난 명령어 수", ("cog", "command"))
+COMMANDS_IN_FLIGHT = Gauge("bot_commands_in_flight", "현재 처리 중인 명령어 수", ("cog", "command"))
+STORAGE_FLUSH_DURATION = Histogram("stock_storage_flush_seconds", "변경분 저장(flush) 시간")
+TICK_DURATION = Histogram("stock_tick_duration_seconds", "시세 갱신(auto_update_stock) 한 번의 처리 시간")
+LOOP_LAG = Histogram("bot_event_loop_lag_seconds", "이벤트 루프 지연 (예정보다 늦게 깨어난 시간)",
+                     buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+LOOP_STALLS = Counter("bot_event_loop_stalls_total", "이벤트 루프가 기준 시간 이상 멈춘 횟수")
+USERS_RESIDENT = Gauge("stock_users_resident", "메모리 캐시에 올라와 있는 유저 수")
+USER_LOADS = Counter("stock_user_loads_total", "캐시에 없어서 저장소에서 읽어 온 유저 수")
+
+
+# --- HTTP 서버 (선택) ---
+async def start_server(port, host="127.0.0.1"):
+    """/metrics 를 제공하는 로컬 HTTP 서버를 띄웁니다. aiohttp 가 없으면 None."""
+    try:
+        from aiohttp import web
+    except ImportError:
+        print("⚠️ aiohttp 가 없어 지표 서버를 시작하지 않습니다.", file=sys.stderr)
+        return None
+
+    async def handle(request):
+        return web.Response(body=render().encode("utf-8"),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"📈 지표 서버: http://{host}:{port}/metrics")
+    return runner
+
+async def stop_server(runner):
+    if runner is not None:
+        await runner.cleanup()
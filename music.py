@@ -1,9 +1,20 @@
 # music.py
 import asyncio
 import discord
-import yt_dlp
+import voice
 import traceback
 import sys
+import os
+import json
+import time
+import hashlib
+import threading
+import functools
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import urlparse, parse_qs
 from discord.ext import commands
 
 # --- 옵션 설정 ---
@@ -13,7 +24,437 @@ ytdl_format_options = {
     'logtostderr': False, 'quiet': True, 'no_warnings': True, 'default_search': 'auto', 'source_address': '0.0.0.0',
 }
 ffmpeg_options = { 'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5', 'options': '-vn' }
-ytdl = yt_dlp.YoutubeDL(ytdl_format_options)
+# yt-dlp 는 import 만으로도 시작 시간의 큰 부분을 차지하므로, 처음 쓸 때(또는 봇 준비 후 백그라운드에서) 불러옵니다.
+_yt_dlp = None
+_ytdl = None
+_yt_dlp_lock = threading.Lock()
+
+def _import_yt_dlp():
+    global _yt_dlp
+    if _yt_dlp is None:
+        with _yt_dlp_lock:
+            if _yt_dlp is None:
+                import yt_dlp
+                _yt_dlp = yt_dlp
+    return _yt_dlp
+
+def get_ytdl():
+    """파일 이름 계산 등 추출 외의 용도로 쓰는 공용 YoutubeDL."""
+    global _ytdl
+    if _ytdl is None:
+        yt_dlp = _import_yt_dlp()
+        with _yt_dlp_lock:
+            if _ytdl is None:
+                _ytdl = yt_dlp.YoutubeDL(ytdl_format_options)
+    return _ytdl
+
+# --- 메타데이터 캐시 설정 ---
+YTDL_CACHE_DIR = "ytdl_cache"      # 디스크 캐시 폴더
+QUERY_CACHE_SIZE = 500             # 메모리에 보관할 검색어 수
+METADATA_CACHE_SIZE = 1000         # 메모리에 보관할 영상 정보 수
+DISK_CACHE_MAX_ENTRIES = 5000      # 디스크 캐시 종류별 최대 파일 수
+STREAM_URL_TTL = 30 * 60           # 스트림 주소를 재사용할 최대 시간(초)
+STREAM_URL_EXPIRY_MARGIN = 5 * 60  # 스트림 주소 만료 시각보다 이만큼 먼저 버립니다.
+
+# --- 추출 작업 설정 ---
+EXTRACT_WORKERS = int(os.getenv("YTDL_EXTRACT_WORKERS", "4"))  # 동시에 실행할 yt-dlp 추출 수 (전체 서버 합계)
+EXTRACT_MAX_PENDING_PER_GUILD = 10                               # 서버 하나가 대기시킬 수 있는 추출 요청 수
+# "thread": 봇 프로세스 안의 스레드에서 추출 / "process": 별도 프로세스에서 추출 (GIL 을 봇과 나눠 쓰지 않음)
+EXTRACT_MODE = os.getenv("YTDL_EXTRACT_MODE", "thread")
+
+# --- 미리 불러오기 설정 ---
+PREFETCH_AHEAD = 2                 # 대기열 앞쪽 몇 곡의 스트림 주소를 미리 준비할지
+PREFETCH_MIN_TTL = 10 * 60         # 남은 유효 시간이 이보다 짧으면 다시 추출합니다.
+PREFETCH_RECHECK_INTERVAL = 60     # 대기열 변화가 없어도 이 간격(초)마다 만료 여부를 다시 확인합니다.
+PREFETCH_RETRY_AFTER = 10 * 60     # 미리 불러오기에 실패한 곡은 이 시간(초)이 지나야 다시 시도합니다.
+
+# GuildState 가 쓰는 필드만 남기고 나머지 yt-dlp 정보는 버립니다. ('url' 은 만료되는 스트림 주소)
+SONG_FIELDS = ('id', 'title', 'webpage_url', 'duration', 'thumbnail')
+
+def _trim_info(data):
+    trimmed = {key: data.get(key) for key in SONG_FIELDS}
+    trimmed['url'] = data.get('url')
+    return trimmed
+
+_thread_local = threading.local()
+
+def _thread_ytdl():
+    """YoutubeDL 은 스레드 안전하지 않으므로 추출 스레드마다 따로 만들어 씁니다."""
+    instance = getattr(_thread_local, 'ytdl', None)
+    if instance is None:
+        instance = _thread_local.ytdl = _import_yt_dlp().YoutubeDL(ytdl_format_options)
+    return instance
+
+def _extract_info(url):
+    """yt-dlp 로 정보를 추출하고 필요한 필드만 남깁니다. 검색 결과는 {'entries': [...]} 형태입니다."""
+    pool = _process_pool
+    if pool is not None:
+        # 추출 스레드는 결과를 기다리기만 하고, 실제 파싱은 워커 프로세스가 합니다.
+        try:
+            return pool.submit(_extract_trimmed, url).result()
+        except BrokenProcessPool:
+            _process_pool_broken(pool)
+    return _extract_trimmed(url)
+
+def _extract_trimmed(url):
+    data = _thread_ytdl().extract_info(url, download=False)
+    if data is None:
+        return None
+    if 'entries' in data:
+        return {'entries': [_trim_info(entry) for entry in data['entries'] if entry]}
+    return _trim_info(data)
+
+
+# --- 프로세스 추출 모드 ---
+_process_pool = None
+_pool_ready = []  # 워커마다 하나씩 넣은 준비 작업
+_pool_lock = threading.Lock()
+
+def _init_extract_worker():
+    # 워커 프로세스가 뜰 때 YoutubeDL(과 추출기 모듈)을 미리 만들어 둡니다.
+    _thread_ytdl()
+
+def _warm_extract_worker():
+    return os.getpid()
+
+def start_process_pool(workers=EXTRACT_WORKERS):
+    """
+    워커 프로세스를 fork 로 띄웁니다. 여러 스레드가 도는 프로세스를 fork 하면 자식이 다른 스레드가 잡고 있던 잠금에 걸릴 수 있으므로,
+    봇의 스레드(저장, 감시, 실행기, 로그인 중 주소 조회)와 음성 연결이 생기기 전에 호출해야 합니다. 워커의 yt-dlp 준비는 기다리지 않습니다.
+    spawn 은 봇 모듈(bot.py)과 데이터 로드를 워커마다 다시 실행하므로, fork 를 쓸 수 없으면 스레드 모드로 남습니다.
+    """
+    global _process_pool
+    if _process_pool is not None:
+        return True
+    if "fork" not in multiprocessing.get_all_start_methods():
+        print("⚠️ fork 를 쓸 수 없는 환경이라 yt-dlp 추출을 스레드 모드로 실행합니다.", file=sys.stderr)
+        return False
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"),
+                               initializer=_init_extract_worker)
+    # fork 방식의 풀은 첫 작업을 넣을 때 (관리 스레드를 만들기 전에) 워커를 한꺼번에 띄우므로, fork 는 여기서 끝납니다.
+    _pool_ready[:] = [pool.submit(_warm_extract_worker) for _ in range(workers)]
+    _process_pool = pool
+    return True
+
+def _process_pool_broken(pool):
+    """워커가 죽어 풀을 더 쓸 수 없으면 스레드 모드로 돌아갑니다."""
+    global _process_pool
+    with _pool_lock:
+        if _process_pool is not pool:
+            return
+        _process_pool = None
+    print("⚠️ yt-dlp 워커 프로세스가 비정상 종료되어 스레드 모드로 전환합니다.", file=sys.stderr)
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def stop_process_pool():
+    global _process_pool
+    with _pool_lock:
+        pool, _process_pool = _process_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def warm_up():
+    """
+    yt-dlp 를 import 하고 YoutubeDL 을 만들어 둡니다. 프로세스 모드면 워커들의 준비도 기다립니다.
+    (블로킹이므로 실행기에서 호출하세요. 끝나기 전에 들어온 요청은 추출 스레드에서 직접 준비합니다)
+    """
+    started = time.perf_counter()
+    get_ytdl()
+    _thread_ytdl()
+    pool = _process_pool
+    if pool is not None:
+        try:
+            for future in _pool_ready:
+                future.result()
+        except BrokenProcessPool:
+            _process_pool_broken(pool)
+    return time.perf_counter() - started
+
+
+class _LRU:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+class _DiskTier:
+    """키 하나당 JSON 파일 하나로 저장합니다. 파일 수가 넘치면 가장 오래 쓰지 않은(mtime) 파일부터 지웁니다."""
+    PRUNE_EVERY = 100
+
+    def __init__(self, directory, max_entries=DISK_CACHE_MAX_ENTRIES):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._puts = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                value = json.load(file)
+            os.utime(path)
+            return value
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def put(self, key, value):
+        path = self._path(key)
+        try:
+            with open(path + ".tmp", "w", encoding="utf-8") as file:
+                json.dump(value, file, ensure_ascii=False)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"yt-dlp 디스크 캐시 저장 오류: {e}", file=sys.stderr)
+            return
+        self._puts += 1
+        if self._puts % self.PRUNE_EVERY == 0:
+            self._prune()
+
+    def _prune(self):
+        try:
+            entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith(".json")]
+            if len(entries) <= self.max_entries:
+                return
+            entries.sort(key=lambda entry: entry.stat().st_mtime)
+            for entry in entries[:len(entries) - self.max_entries]:
+                os.remove(entry.path)
+        except OSError as e:
+            print(f"yt-dlp 디스크 캐시 정리 오류: {e}", file=sys.stderr)
+
+
+class MetadataCache:
+    """
+    yt-dlp 조회 결과 캐시.
+    - 검색어 -> 영상 ID 목록, 영상 ID -> 메타데이터 : 메모리 LRU + 디스크
+    - 영상 ID -> 스트림 주소 : 만료되는 주소라서 메모리에만 짧게 보관
+    여러 스레드(추출 작업)에서 동시에 쓰므로 잠금으로 보호합니다.
+    """
+    def __init__(self, directory=YTDL_CACHE_DIR):
+        self.queries = _LRU(QUERY_CACHE_SIZE)
+        self.metadata = _LRU(METADATA_CACHE_SIZE)
+        self.query_disk = _DiskTier(os.path.join(directory, "queries"))
+        self.metadata_disk = _DiskTier(os.path.join(directory, "videos"))
+        self._streams = {}  # video id -> (스트림 주소, 만료 시각)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _query_key(query):
+        return " ".join(query.lower().split())
+
+    def lookup_query(self, query, disk=True):
+        """검색어에 해당하는 영상 정보 목록. 메모리와 (disk 이면) 디스크에 모두 없으면 None."""
+        key = self._query_key(query)
+        with self._lock:
+            video_ids = self.queries.get(key)
+        if video_ids is None and disk:
+            video_ids = self.query_disk.get(key)
+            if video_ids is not None:
+                with self._lock:
+                    self.queries.put(key, video_ids)
+        if video_ids is None:
+            return None
+        songs = [self.lookup_video(video_id, disk=disk) for video_id in video_ids]
+        return None if any(song is None for song in songs) else songs
+
+    def lookup_video(self, video_id, disk=True):
+        with self._lock:
+            song = self.metadata.get(video_id)
+        if song is None and disk:
+            song = self.metadata_disk.get(video_id)
+            if song is not None:
+                with self._lock:
+                    self.metadata.put(video_id, song)
+        return dict(song) if song is not None else None
+
+    def stream_ttl(self, video_id):
+        """캐시된 스트림 주소가 앞으로 몇 초 더 유효한지. 없으면 0."""
+        with self._lock:
+            entry = self._streams.get(video_id)
+        return max(0.0, entry[1] - time.time()) if entry else 0.0
+
+    def lookup_stream(self, video_id):
+        with self._lock:
+            entry = self._streams.get(video_id)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._streams[video_id]
+                return None
+            return entry[0]
+
+    def store(self, info, query=None):
+        """추출 결과(_extract_info 형식)를 캐시에 넣습니다. query 가 있으면 검색어 캐시에도 넣습니다."""
+        entries = info['entries'] if 'entries' in info else [info]
+        for entry in entries:
+            if not entry.get('id'):
+                continue
+            song = {key: entry.get(key) for key in SONG_FIELDS}
+            with self._lock:
+                self.metadata.put(entry['id'], song)
+                if entry.get('url'):
+                    self._streams[entry['id']] = (entry['url'], self._stream_expiry(entry['url']))
+            self.metadata_disk.put(entry['id'], song)
+        if query is not None:
+            video_ids = [entry['id'] for entry in entries if entry.get('id')]
+            key = self._query_key(query)
+            with self._lock:
+                self.queries.put(key, video_ids)
+            self.query_disk.put(key, video_ids)
+
+    def _stream_expiry(self, url):
+        now = time.time()
+        expiry = now + STREAM_URL_TTL
+        # 유튜브 스트림 주소에는 만료 시각(expire=유닉스 시간)이 들어 있습니다.
+        expire_param = parse_qs(urlparse(url).query).get('expire')
+        if expire_param and expire_param[0].isdigit():
+            expiry = min(expiry, int(expire_param[0]) - STREAM_URL_EXPIRY_MARGIN)
+        return expiry
+
+metadata_cache = MetadataCache()
+
+def _search_cached(query, limit):
+    """(워커 스레드) 검색어를 캐시에서 찾고, 없으면 추출해서 캐시에 넣은 뒤 영상 정보 목록을 돌려줍니다."""
+    cache_key = f"ytsearch{limit}:{query}"
+    songs = metadata_cache.lookup_query(cache_key)
+    if songs is not None:
+        return songs
+    info = _extract_info(cache_key)
+    if not info or not info.get('entries'):
+        return []
+    metadata_cache.store(info, query=cache_key)
+    return [{key: entry.get(key) for key in SONG_FIELDS} for entry in info['entries']]
+
+def _stream_info_cached(url, video_id=None):
+    """(워커 스레드) 재생에 필요한 정보(스트림 주소 포함)를 캐시에서 찾고, 없거나 만료되었으면 다시 추출합니다."""
+    if video_id:
+        stream_url = metadata_cache.lookup_stream(video_id)
+        song = metadata_cache.lookup_video(video_id) if stream_url else None
+        if song is not None:
+            song['url'] = stream_url
+            return song
+    data = _extract_info(url)
+    if data and 'entries' in data:
+        data = data['entries'][0] if data['entries'] else None
+    if not data:
+        raise ValueError(f"영상 정보를 가져올 수 없습니다: {url}")
+    metadata_cache.store(data)
+    return data
+
+class ExtractionBusy(commands.CommandError):
+    """서버별 추출 대기열이 가득 찼을 때 발생합니다."""
+
+
+class ExtractionScheduler:
+    """
+    yt-dlp 추출 전용 스레드 풀.
+    - 전체 동시 실행 수를 EXTRACT_WORKERS 로 제한해 기본 실행기(다른 기능들)를 굶기지 않습니다.
+    - 대기 중인 요청은 서버별 큐에 넣고 서버를 돌아가며 하나씩 꺼내서, 한 서버의 폭주가 다른 서버를 막지 않습니다.
+    - 같은 키(같은 검색어/같은 영상)의 요청이 이미 진행 중이면 새로 추출하지 않고 그 결과를 함께 기다립니다.
+    - 요청 종류(lane): "request" 는 명령어 요청으로 서버별 대기 수 제한을 받고, "prefetch" 는 제한 없이 같은 큐에 들어가며,
+      "playback" 은 지금 재생할 곡이라 제한 없이 별도 큐에서 가장 먼저 꺼냅니다. 요청이 몰려도 재생이 멈추지 않게 하기 위해서입니다.
+    이벤트 루프 스레드에서만 호출됩니다.
+    """
+    def __init__(self, max_workers=EXTRACT_WORKERS, max_pending_per_guild=EXTRACT_MAX_PENDING_PER_GUILD):
+        self.max_workers = max_workers
+        self.max_pending_per_guild = max_pending_per_guild
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ytdl-extract")
+        self._running = 0
+        self._pending = OrderedDict()  # guild_id -> deque[(key, future, func, args)], 순서가 곧 차례
+        self._playback = deque()       # 지금 재생할 곡의 추출 (key, future, func, args)
+        self._inflight = {}            # key -> asyncio.Future
+
+    async def run(self, guild_id, key, func, *args, lane="request"):
+        loop = asyncio.get_running_loop()
+        future = self._inflight.get(key)
+        if future is None:
+            queue = self._pending.get(guild_id)
+            if lane == "request" and queue is not None and len(queue) >= self.max_pending_per_guild:
+                raise ExtractionBusy("처리 중인 음악 요청이 너무 많습니다. 잠시 후 다시 시도해주세요.")
+            future = loop.create_future()
+            self._inflight[key] = future
+            entry = (key, future, func, args)
+            if lane == "playback":
+                self._playback.append(entry)
+            else:
+                self._pending.setdefault(guild_id, deque()).append(entry)
+            self._dispatch(loop)
+        elif lane == "playback":
+            # 미리 불러오기 등으로 이미 대기 중인 곡이 재생 차례가 되면 맨 앞으로 옮깁니다.
+            self._promote(guild_id, key)
+        # 기다리던 명령이 취소되어도 같은 결과를 기다리는 다른 요청에는 영향을 주지 않습니다.
+        return await asyncio.shield(future)
+
+    def _promote(self, guild_id, key):
+        queue = self._pending.get(guild_id)
+        for entry in queue or ():
+            if entry[0] == key:
+                queue.remove(entry)
+                if not queue:
+                    del self._pending[guild_id]
+                self._playback.append(entry)
+                return
+
+    def _dispatch(self, loop):
+        while self._running < self.max_workers and (self._playback or self._pending):
+            if self._playback:
+                key, future, func, args = self._playback.popleft()
+            else:
+                guild_id, queue = next(iter(self._pending.items()))
+                key, future, func, args = queue.popleft()
+                if queue:
+                    self._pending.move_to_end(guild_id)
+                else:
+                    del self._pending[guild_id]
+            self._running += 1
+            job = loop.run_in_executor(self._executor, func, *args)
+            job.add_done_callback(functools.partial(self._finished, loop, key, future))
+
+    def _finished(self, loop, key, future, job):
+        self._running -= 1
+        self._inflight.pop(key, None)
+        if not future.done():
+            if job.cancelled():
+                future.cancel()
+            elif job.exception() is not None:
+                future.set_exception(job.exception())
+            else:
+                future.set_result(job.result())
+        self._dispatch(loop)
+
+extractor = ExtractionScheduler()
+
+def _download_info(url):
+    data = _thread_ytdl().extract_info(url, download=True)
+    return data['entries'][0] if 'entries' in data else data
+
+def _stream_key(url, video_id=None):
+    return f"stream:{video_id or url}"
+
+async def search_songs(query, *, guild_id=None, limit=1):
+    """검색어로 영상 정보 목록을 찾습니다. 메모리 캐시에 있으면 스레드를 거치지 않고 바로 돌려줍니다."""
+    cached = metadata_cache.lookup_query(f"ytsearch{limit}:{query}", disk=False)
+    if cached is not None:
+        return cached
+    key = f"search{limit}:{MetadataCache._query_key(query)}"
+    songs = await extractor.run(guild_id, key, _search_cached, query, limit)
+    # 중복 제거로 같은 결과를 여러 요청이 나눠 받으므로 각자 복사본을 씁니다.
+    return [dict(song) for song in songs]
+
 
 class YTDLSource(discord.PCMVolumeTransformer):
     def __init__(self, source, *, data, volume=0.5):
@@ -26,19 +467,25 @@ class YTDLSource(discord.PCMVolumeTransformer):
         self.requester = data.get('requester')
 
     @classmethod
-    async def from_url(cls, url, *, loop=None, stream=True, requester=None):
+    async def from_url(cls, url, *, loop=None, stream=True, requester=None, video_id=None, guild_id=None, lane="request"):
         loop = loop or asyncio.get_event_loop()
-        data = await loop.run_in_executor(None, lambda: ytdl.extract_info(url, download=not stream))
-        if 'entries' in data: data = data['entries'][0]
+        if stream:
+            # 아직 유효한 스트림 주소가 캐시에 있으면(미리 불러온 곡 등) 추출 없이 바로 재생합니다.
+            stream_url = metadata_cache.lookup_stream(video_id) if video_id else None
+            data = metadata_cache.lookup_video(video_id, disk=False) if stream_url else None
+            if data is not None:
+                data['url'] = stream_url
+            else:
+                data = dict(await extractor.run(guild_id, _stream_key(url, video_id), _stream_info_cached, url, video_id, lane=lane))
+        else:
+            data = await extractor.run(guild_id, f"download:{url}", _download_info, url, lane=lane)
         data['requester'] = requester
-        filename = data['url'] if stream else ytdl.prepare_filename(data)
+        filename = data['url'] if stream else get_ytdl().prepare_filename(data)
         return cls(discord.FFmpegPCMAudio(filename, **ffmpeg_options), data=data)
 
     @classmethod
-    async def search(cls, query, *, loop=None):
-        loop = loop or asyncio.get_event_loop()
-        data = await loop.run_in_executor(None, lambda: ytdl.extract_info(f"ytsearch5:{query}", download=False))
-        return data.get('entries')
+    async def search(cls, query, *, guild_id=None):
+        return await search_songs(query, guild_id=guild_id, limit=5)
 
 class GuildState:
     def __init__(self, bot, guild):
@@ -49,13 +496,54 @@ class GuildState:
         self.next_song = asyncio.Event()
         self.current_song = None
         self.player_task = None
+        self.prefetch_task = None
+        self.prefetch_wakeup = asyncio.Event()
+        self.prefetch_failed = {}  # 추출에 실패한 영상 ID -> 다시 시도할 시각 (재생할 때는 바로 다시 시도합니다)
         self.loop = False
         self.loop_one = False
 
+    async def enqueue(self, song):
+        await self.queue.put(song)
+        self.prefetch_wakeup.set()
+
     def start_player_task(self, ctx):
         self.channel = ctx.channel
         if not self.player_task or self.player_task.done():
+            # 음악이 도는 동안에는 음성 연결이 유휴 시간으로 끊기거나 효과음 때문에 옮겨가지 않게 잡아 둡니다.
+            voice.voice_manager.hold(self.guild)
             self.player_task = self.bot.loop.create_task(self.player_loop(ctx))
+        if not self.prefetch_task or self.prefetch_task.done():
+            self.prefetch_task = self.bot.loop.create_task(self.prefetch_loop())
+
+    def upcoming(self, count):
+        """다음에 재생될 곡들. 한 곡 반복 중이면 현재 곡이 다시 재생됩니다."""
+        if self.loop_one and self.current_song:
+            return [self.current_song]
+        return list(self.queue._queue)[:count]
+
+    async def prefetch_loop(self):
+        """
+        현재 곡이 재생되는 동안 다음 곡들의 스트림 주소를 미리 추출해 캐시에 넣어 둡니다.
+        주소는 시간이 지나면 만료되므로 남은 시간이 짧아지면 다시 추출합니다.
+        """
+        while True:
+            self.prefetch_wakeup.clear()
+            for song in self.upcoming(PREFETCH_AHEAD):
+                video_id = song.get('id')
+                if not video_id or self.prefetch_failed.get(video_id, 0) > time.monotonic():
+                    continue
+                if metadata_cache.stream_ttl(video_id) > PREFETCH_MIN_TTL:
+                    continue
+                try:
+                    await extractor.run(self.guild.id, _stream_key(song['webpage_url'], video_id),
+                                        _stream_info_cached, song['webpage_url'], None, lane="prefetch")
+                except Exception as e:
+                    self.prefetch_failed[video_id] = time.monotonic() + PREFETCH_RETRY_AFTER
+                    print(f"다음 곡 미리 불러오기 실패 ({song.get('title')}): {e}", file=sys.stderr)
+            try:
+                await asyncio.wait_for(self.prefetch_wakeup.wait(), timeout=PREFETCH_RECHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
 
     async def player_loop(self, ctx):
         await self.bot.wait_until_ready()
@@ -73,11 +561,24 @@ class GuildState:
                     return await cog.cleanup(self.guild)
 
             self.current_song = song_to_play
+            self.prefetch_failed.pop(song_to_play.get('id'), None)
             if self.loop and not self.loop_one:
                 await self.queue.put(self.current_song)
+            # 재생이 시작되는 동안 다음 곡 준비를 시작합니다.
+            self.prefetch_wakeup.set()
 
-            source = await YTDLSource.from_url(self.current_song['webpage_url'], loop=self.bot.loop, stream=True, requester=self.current_song['requester'])
-            self.guild.voice_client.play(source, after=lambda e: self.bot.loop.call_soon_threadsafe(self.next_song.set))
+            try:
+                source = await YTDLSource.from_url(self.current_song['webpage_url'], loop=self.bot.loop, stream=True, requester=self.current_song['requester'],
+                                                   video_id=self.current_song.get('id'), guild_id=self.guild.id, lane="playback")
+            except Exception as e:
+                # 한 곡을 불러오지 못해도 플레이어는 멈추지 않고 다음 곡으로 넘어갑니다.
+                print(f"곡 불러오기 실패 ({self.current_song.get('title')}): {e}", file=sys.stderr)
+                if self.channel:
+                    await self.channel.send(f"⚠️ **{self.current_song.get('title', '알 수 없는 곡')}** 을(를) 불러오지 못해 건너뜁니다.")
+                if self.loop_one:
+                    self.loop_one = False
+                continue
+            voice.voice_manager.play_music(self.guild, source, after=lambda e: self.bot.loop.call_soon_threadsafe(self.next_song.set))
             
             embed = discord.Embed(title="🎵 재생 시작", description=f"[{source.title}]({source.url})", color=discord.Color.green())
             embed.set_thumbnail(url=source.thumbnail)
@@ -93,6 +594,25 @@ class Music(commands.Cog, name="음악"):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.guild_states = {}
+        self.warm_task = None
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # 명령어는 이미 등록되어 있고, 무거운 yt-dlp 준비는 봇이 준비된 뒤 백그라운드에서 합니다.
+        if self.warm_task is None:
+            self.warm_task = self.bot.loop.create_task(self._warm_up())
+
+    async def _warm_up(self):
+        try:
+            seconds = await self.bot.loop.run_in_executor(extractor._executor, warm_up)
+        except Exception as e:
+            print(f"yt-dlp 준비 중 오류 발생: {e}", file=sys.stderr)
+            return
+        mode = f"워커 프로세스 {EXTRACT_WORKERS}개" if _process_pool is not None else "스레드 모드"
+        print(f"🎵 yt-dlp 준비 완료 ({mode}, {seconds:.2f}초)")
+
+    async def cog_unload(self):
+        stop_process_pool()
 
     def get_guild_state(self, guild) -> GuildState:
         if guild.id not in self.guild_states:
@@ -103,15 +623,17 @@ class Music(commands.Cog, name="음악"):
         if guild.id in self.guild_states:
             state = self.get_guild_state(guild)
             if state.player_task: state.player_task.cancel()
+            if state.prefetch_task: state.prefetch_task.cancel()
             del self.guild_states[guild.id]
-        if guild.voice_client:
-            await guild.voice_client.disconnect()
+        voice.voice_manager.release(guild)
+        await voice.voice_manager.disconnect(guild)
             
     async def cog_before_invoke(self, ctx: commands.Context):
         ctx.state = self.get_guild_state(ctx.guild)
     
     async def cog_command_error(self, ctx: commands.Context, error: commands.CommandError):
         if isinstance(error, commands.CheckFailure): return
+        if isinstance(error, ExtractionBusy): return await ctx.send(f"⏳ {error}")
         print(f"Music Cog에서 오류 발생: {error}", file=sys.stderr)
         traceback.print_exc()
         await ctx.send(f"🎵 음악 기능 중 오류가 발생했습니다: `{error}`")
@@ -123,8 +645,7 @@ class Music(commands.Cog, name="음악"):
             return await ctx.send("먼저 음성 채널에 참가해주세요.")
         
         destination = ctx.author.voice.channel
-        if ctx.voice_client: await ctx.voice_client.move_to(destination)
-        else: await destination.connect()
+        await voice.voice_manager.connect(destination, move=True)
         await ctx.send(f"✅ **{destination}** 채널에 연결했습니다.")
 
     @commands.command(name='나가', aliases=['leave', 'stop'])
@@ -138,11 +659,11 @@ class Music(commands.Cog, name="음악"):
         """노래 제목이나 URL을 입력하여 노래를 재생하거나 대기열에 추가합니다."""
         if not ctx.voice_client: await ctx.invoke(self._join)
         async with ctx.typing():
-            info = await self.bot.loop.run_in_executor(None, lambda: ytdl.extract_info(f"ytsearch:{query}", download=False))
-            if not info or not info.get('entries'): return await ctx.send("❌ 검색 결과가 없습니다.")
-            song = info['entries'][0]
+            results = await search_songs(query, guild_id=ctx.guild.id)
+            if not results: return await ctx.send("❌ 검색 결과가 없습니다.")
+            song = results[0]
             song['requester'] = ctx.author.display_name
-            await ctx.state.queue.put(song)
+            await ctx.state.enqueue(song)
             await ctx.send(f"📌 **{song['title']}**을(를) 대기열에 추가했습니다.")
             ctx.state.start_player_task(ctx)
 
@@ -151,7 +672,7 @@ class Music(commands.Cog, name="음악"):
         """노래를 검색하여 목록에서 선택해 재생합니다."""
         if not ctx.voice_client: await ctx.invoke(self._join)
         async with ctx.typing():
-            results = await YTDLSource.search(query, loop=self.bot.loop)
+            results = await YTDLSource.search(query, guild_id=ctx.guild.id)
             if not results: return await ctx.send("❌ 검색 결과가 없습니다.")
 
         embed = discord.Embed(title="🔎 검색 결과", description="재생할 노래의 번호를 30초 안에 입력해주세요.", color=0x3498DB)
@@ -169,7 +690,7 @@ class Music(commands.Cog, name="음악"):
             
             song = results[index]
             song['requester'] = ctx.author.display_name
-            await ctx.state.queue.put(song)
+            await ctx.state.enqueue(song)
             await ctx.send(f"📌 **{song['title']}**을(를) 대기열에 추가했습니다.")
             ctx.state.start_player_task(ctx)
             await search_msg.delete()
@@ -188,8 +709,7 @@ class Music(commands.Cog, name="음악"):
     @commands.command(name='일시정지', aliases=['pause'])
     async def _pause(self, ctx: commands.Context):
         """노래를 일시정지합니다."""
-        if ctx.voice_client and ctx.voice_client.is_playing():
-            ctx.voice_client.pause()
+        if voice.voice_manager.pause_music(ctx.guild):
             await ctx.send("⏸️ 노래를 일시정지합니다.")
 
     @commands.command(name='재개', aliases=['resume'])
@@ -243,4 +763,7 @@ class Music(commands.Cog, name="음악"):
         await ctx.send(f"🔂 한 곡 반복: **{'켜짐' if ctx.state.loop_one else '꺼짐'}**")
 
 async def setup(bot: commands.Bot):
+    if EXTRACT_MODE == "process":
+        # 워커는 fork 로 띄우므로 bot.py 는 로그인하기 전에 (다른 스레드가 생기기 전에) 이 확장을 불러옵니다.
+        start_process_pool()
     await bot.add_cog(Music(bot))
\ No newline at end of file
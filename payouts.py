@@ -0,0 +1,78 @@
+# payouts.py
+# 도박 게임의 배당 규칙. stock.py 의 게임 로직과 rtp_sim.py 시뮬레이터가 함께 씁니다.
+import itertools
+
+# --- 슬롯머신 ---
+# (심볼, 세 개가 모두 같을 때 배수, 릴 하나에서 나올 가중치)
+SLOT_REELS = [
+    ('💎', 20, 2),
+    ('💰', 10, 5),
+    ('7️⃣', 5, 8),
+    ('🍒', 2, 12),
+    ('💔', 0, 10)
+]
+SLOT_REEL_COUNT = 3
+SLOT_PAIR_SYMBOL = '🍒'      # 이 심볼이 정확히 두 개 나오면
+SLOT_PAIR_MULTIPLIER = 1     # 베팅 금액을 돌려줍니다.
+
+SLOT_SYMBOLS = [item[0] for item in SLOT_REELS]
+SLOT_WEIGHTS = [item[2] for item in SLOT_REELS]
+_SLOT_TRIPLE = {item[0]: item[1] for item in SLOT_REELS}
+
+# --- 주사위 ---
+DICE_SIDES = 6
+DICE_DOUBLE_MULTIPLIER = 4   # 두 주사위가 같은 눈
+DICE_SEVEN_MULTIPLIER = 2    # 합이 7
+
+# --- 동전 던지기 ---
+COIN_SIDES = ('앞', '뒤')
+COIN_MULTIPLIER = 2
+
+
+def slot_multiplier(reels):
+    """릴 결과에 대한 배수 (당첨금 = 베팅 금액 x 배수)"""
+    if reels[0] == reels[1] == reels[2]:
+        return _SLOT_TRIPLE.get(reels[0], 0)
+    if reels.count(SLOT_PAIR_SYMBOL) == 2:
+        return SLOT_PAIR_MULTIPLIER
+    return 0
+
+def dice_multiplier(dice1, dice2):
+    if dice1 == dice2:
+        return DICE_DOUBLE_MULTIPLIER
+    if dice1 + dice2 == 7:
+        return DICE_SEVEN_MULTIPLIER
+    return 0
+
+def coin_multiplier(choice, result):
+    return COIN_MULTIPLIER if choice == result else 0
+
+
+def outcome_table(game):
+    """
+    게임의 모든 결과를 나열해 {배수: 확률} 로 돌려줍니다.
+    위의 배당 함수를 그대로 호출하므로 시뮬레이터가 실제 게임과 다른 규칙을 쓸 일이 없습니다.
+    """
+    table = {}
+    if game == "slot":
+        total = sum(SLOT_WEIGHTS)
+        for combo in itertools.product(range(len(SLOT_SYMBOLS)), repeat=SLOT_REEL_COUNT):
+            probability = 1.0
+            for index in combo:
+                probability *= SLOT_WEIGHTS[index] / total
+            multiplier = slot_multiplier([SLOT_SYMBOLS[index] for index in combo])
+            table[multiplier] = table.get(multiplier, 0.0) + probability
+    elif game == "dice":
+        for dice1, dice2 in itertools.product(range(1, DICE_SIDES + 1), repeat=2):
+            multiplier = dice_multiplier(dice1, dice2)
+            table[multiplier] = table.get(multiplier, 0.0) + 1 / DICE_SIDES ** 2
+    elif game == "coin":
+        # 플레이어의 선택은 결과와 무관하므로 첫 번째 면을 고른 것으로 계산합니다.
+        for result in COIN_SIDES:
+            multiplier = coin_multiplier(COIN_SIDES[0], result)
+            table[multiplier] = table.get(multiplier, 0.0) + 1 / len(COIN_SIDES)
+    else:
+        raise ValueError(f"알 수 없는 게임: {game}")
+    return table
+
+GAMES = ("slot", "dice", "coin")
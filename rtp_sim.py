@@ -0,0 +1,116 @@
+# rtp_sim.py
+# 도박 게임의 환수율(RTP)과 분산을 몬테카를로로 측정합니다.
+#   python rtp_sim.py --rounds 50000000
+#   python rtp_sim.py --game slot --mode direct --rounds 5000000
+import argparse
+import json
+import math
+import random
+import time
+from collections import Counter
+
+import payouts
+
+DEFAULT_ROUNDS = 10_000_000
+DEFAULT_BATCH = 1_000_000
+DEFAULT_BET = 1000
+
+
+def exact_stats(table):
+    """결과표에서 계산한 정확한 RTP 와 1판당 분산 (베팅 금액 1 기준)"""
+    rtp = sum(multiplier * probability for multiplier, probability in table.items())
+    second_moment = sum(multiplier * multiplier * probability for multiplier, probability in table.items())
+    return rtp, second_moment - rtp * rtp
+
+
+def _draw_joint(rng, table, batch):
+    """결과표(배수별 확률)에서 한 번에 batch 판을 뽑아 배수별 횟수로 돌려줍니다."""
+    multipliers = list(table)
+    cum_weights, total = [], 0.0
+    for multiplier in multipliers:
+        total += table[multiplier]
+        cum_weights.append(total)
+    return Counter(rng.choices(multipliers, cum_weights=cum_weights, k=batch))
+
+
+def _draw_direct(rng, game, batch):
+    """실제 게임처럼 릴/주사위/동전을 하나씩 뽑고 배당 함수로 판정합니다. (느리지만 교차 검증용)"""
+    if game == "slot":
+        count = payouts.SLOT_REEL_COUNT
+        symbols = rng.choices(payouts.SLOT_SYMBOLS, weights=payouts.SLOT_WEIGHTS, k=batch * count)
+        return Counter(payouts.slot_multiplier(symbols[i:i + count]) for i in range(0, len(symbols), count))
+    if game == "dice":
+        faces = range(1, payouts.DICE_SIDES + 1)
+        rolls = rng.choices(faces, k=batch * 2)
+        return Counter(map(payouts.dice_multiplier, rolls[0::2], rolls[1::2]))
+    results = rng.choices(payouts.COIN_SIDES, k=batch)
+    return Counter(payouts.coin_multiplier(payouts.COIN_SIDES[0], result) for result in results)
+
+
+def simulate(game, rounds, batch=DEFAULT_BATCH, mode="joint", seed=None):
+    rng = random.Random(seed)
+    table = payouts.outcome_table(game)
+    counts = Counter()
+    started = time.perf_counter()
+    remaining = rounds
+    while remaining > 0:
+        size = min(batch, remaining)
+        counts.update(_draw_joint(rng, table, size) if mode == "joint" else _draw_direct(rng, game, size))
+        remaining -= size
+    elapsed = time.perf_counter() - started
+
+    total = sum(multiplier * count for multiplier, count in counts.items())
+    total_sq = sum(multiplier * multiplier * count for multiplier, count in counts.items())
+    rtp = total / rounds
+    variance = total_sq / rounds - rtp * rtp
+    exact_rtp, exact_variance = exact_stats(table)
+    return {
+        "game": game,
+        "mode": mode,
+        "rounds": rounds,
+        "rtp": rtp,
+        "rtp_ci95": 1.96 * math.sqrt(variance / rounds),
+        "variance": variance,
+        "exact_rtp": exact_rtp,
+        "exact_variance": exact_variance,
+        "house_edge": 1 - exact_rtp,
+        "hit_rate": 1 - counts.get(0, 0) / rounds,
+        "seconds": elapsed,
+        "rounds_per_sec": rounds / elapsed if elapsed > 0 else float("inf"),
+    }
+
+
+def print_report(result, bet):
+    print(f"[{result['game']}] {result['rounds']:,}판 ({result['mode']}) - {result['seconds']:.2f}초, {result['rounds_per_sec']:,.0f}판/초")
+    print(f"  RTP       : {result['rtp']:.5f} ± {result['rtp_ci95']:.5f} (정확한 값 {result['exact_rtp']:.5f})")
+    print(f"  하우스 엣지: {result['house_edge'] * 100:.3f}%   당첨 확률: {result['hit_rate'] * 100:.2f}%")
+    print(f"  분산      : {result['variance']:.4f} (정확한 값 {result['exact_variance']:.4f}), 표준편차 {math.sqrt(result['exact_variance']):.4f}")
+    # 유저가 잃은 돈은 사라지고 딴 돈은 새로 생기므로, 게임 한 판이 통화량을 얼마나 바꾸는지 보여줍니다.
+    per_round = (result['exact_rtp'] - 1) * bet
+    print(f"  통화량 변화: 판당 {per_round:+,.2f}원, 100만 판당 {per_round * 1_000_000:+,.0f}원 (베팅 {bet:,}원 기준)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="도박 게임 RTP 시뮬레이터")
+    parser.add_argument("--game", choices=payouts.GAMES + ("all",), default="all")
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS)
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH, help="한 번에 뽑을 판 수")
+    parser.add_argument("--mode", choices=("joint", "direct"), default="joint",
+                        help="joint: 결과표에서 바로 추첨 / direct: 실제 게임처럼 릴·주사위를 굴려 판정")
+    parser.add_argument("--bet", type=int, default=DEFAULT_BET, help="통화량 계산에 쓸 평균 베팅 금액")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", metavar="PATH", help="결과를 JSON 파일로 저장")
+    args = parser.parse_args()
+
+    games = payouts.GAMES if args.game == "all" else (args.game,)
+    results = []
+    for game in games:
+        result = simulate(game, args.rounds, args.batch, args.mode, args.seed)
+        print_report(result, args.bet)
+        results.append(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,65 @@
 # stock.py
 import json
+import math
 import random
 import os
 import copy
 import sys
+import time
+import sqlite3
+import threading
+import functools
+import contextlib
+import atexit
+import bisect
+import heapq
+import itertools
+from collections import OrderedDict
+from array import array
+from collections.abc import Mapping, MutableMapping
 from datetime import datetime
+import payouts
+import metrics
 
 # --- 파일 및 기본 데이터 설정 ---
 STOCK_FILE = "stocks.json"
 USER_FILE = "users.json"
 MARKET_EVENT_FILE = "market_event.json"
+USER_JOURNAL_FILE = "users.journal"
+USER_INDEX_FILE = "users.index"  # users.json 안의 유저별 위치와 랭킹 요약
+SQLITE_FILE = "economy.db"
+
+# --- 저장 방식 설정 ---
+STORAGE_BACKEND = os.getenv("STOCK_STORAGE", "json").lower()  # "json"(기본) 또는 "sqlite"
+# 저널 모드에서는 거래마다 users.json 전체를 다시 쓰지 않고, 변경된 유저 한 명의 기록만 저널 파일 끝에 덧붙입니다.
+USE_USER_JOURNAL = os.getenv("USER_JOURNAL", "1") != "0"
+JOURNAL_COMPACT_THRESHOLD = 1000  # 저널 기록이 이만큼 쌓이면 users.json 스냅샷으로 압축
+FLUSH_INTERVAL_MS = int(os.getenv("STOCK_FLUSH_INTERVAL_MS", "500"))  # 변경분을 모아서 저장하는 간격
+USER_LOCK_STRIPES = 256  # 유저 잠금 개수. 유저 수와 무관하게 고정된 수의 잠금을 나눠 씁니다.
+# 메모리에 올려 둘 최근 유저 수. 나머지 유저는 필요할 때 저장소에서 읽고, 랭킹은 유저별 요약만으로 계산합니다.
+USER_CACHE_SIZE = int(os.getenv("STOCK_USER_CACHE_SIZE", "10000"))
+USER_IDLE_SECONDS = 30 * 60  # 이 시간 동안 쓰이지 않은 유저는 캐시에 자리가 있어도 내립니다.
+USER_IDLE_CHECK_SECONDS = 60  # 저장할 변경이 없어도 이 간격마다 오래 안 쓴 유저를 내립니다.
+USER_EVICT_SCAN = 32         # 한 번에 내릴 유저를 찾으며 건너뛸 수 있는 최대 유저 수 (저장 대기 중이거나 사용 중인 유저)
 
 # --- 현실성 강화를 위한 상수 ---
 TRADING_FEE_RATE = 0.002  # 거래 수수료 0.2%
 
+PORTFOLIO_CACHE_SIZE = 1000  # 자산 현황 캐시에 보관할 최대 유저 수
+
+# --- 시장 이벤트 설정 ---
+MARKET_EVENT_CHANCE = 0.2             # 틱마다 새 이벤트가 생길 확률
+MARKET_STOCK_EVENT_RATIO = 0.3        # 새 이벤트 중 분야 대신 개별 종목을 대상으로 하는 비율
+MARKET_EVENT_DURATION = (10 * 60, 60 * 60)  # 이벤트 지속 시간 범위(초)
+MARKET_EVENT_MAX_ACTIVE = 5           # 동시에 진행될 수 있는 최대 이벤트 수
+
+# --- 시세 기록 설정 ---
+HISTORY_TICKS = 24 * 60  # 종목별로 보관할 최근 틱 수 (1분 틱 기준 하루치)
+CANDLE_INTERVALS = {     # 봉 이름: (봉 하나의 길이(초), 보관할 봉 개수)
+    "1h": (60 * 60, 24 * 7),
+    "1d": (24 * 60 * 60, 90),
+}
+
 # ⭐ 사용자의 요청에 따라 주식 종목을 8개로 엄선하고 재구성
 DEFAULT_STOCKS = {
     "Apple":    {"price": 170.0, "sector": "IT", "volatility": 1.0, "total_shares": 10000, "available_shares": 10000},
@@ -46,60 +92,1348 @@ def save_data(filename, data):
     except IOError as e:
         print(f"데이터 저장 오류 {filename}: {e}", file=sys.stderr)
 
+def write_json_atomic(filename, data):
+    """임시 파일에 먼저 쓴 뒤 교체하여, 저장 도중 종료되어도 기존 파일이 깨지지 않게 합니다. 실패하면 IOError를 그대로 올립니다."""
+    temp_filename = f"{filename}.tmp"
+    with open(temp_filename, "w", encoding="utf-8") as file:
+        json.dump(data, file, indent=4, ensure_ascii=False)
+    os.replace(temp_filename, filename)
+
+def _dumps_user(user):
+    return json.dumps(user, ensure_ascii=False, separators=(",", ":"))
+
+def _summary_record(user):
+    """저장해 두는 랭킹 요약 [현금, {종목: 수량}]. 대기 주문이 있으면 주문장 복구용으로 세 번째 항목에 함께 담습니다."""
+    cash, holdings = _summarize_user(user)
+    record = [cash, holdings]
+    if user.get("orders"):
+        record.append(user["orders"])
+    return record
+
+def _read_summary(record, user_id, summaries, open_orders):
+    summaries[user_id] = (record[0], record[1])
+    if len(record) > 2:
+        open_orders.extend((order_id, user_id, order) for order_id, order in record[2].items())
+
+# --- 저장소 백엔드 ---
+# 백엔드는 백그라운드 저장 스레드가 넘겨주는 '스냅샷'만 다룹니다. 실제 users/stocks 딕셔너리는 건드리지 않습니다.
+# 시작할 때는 load_summaries 로 저장해 둔 랭킹 요약만 읽고, 유저 데이터는 쓰일 때 load_user 로 한 명씩 읽습니다.
+# 캐시에서 내린 유저는 release_user 로 돌려받습니다.
+class JsonBackend:
+    """
+    기본 저장소. stocks.json / users.json 에 저장하며, 저널 모드에서는 유저 변경분을 users.journal 에 덧붙입니다.
+    users.json 은 한 줄에 유저 한 명씩 쓰고, users.index 에 유저별 위치(바이트)와 랭킹 요약을 함께 적어 둡니다.
+    시작할 때는 색인만 읽고, 유저 데이터는 필요할 때 그 위치만 읽어 옵니다.
+    """
+
+    def __init__(self, use_journal=True):
+        self.use_journal = use_journal
+        self._journal_file = None
+        self._journal_count = 0
+        self._index = {}        # user_id -> (users.json 안의 위치, 길이)
+        self._user_file = None  # 위치로 읽기 위한 users.json 읽기 핸들
+        self._read_lock = threading.Lock()
+        # 마지막 스냅샷 뒤로 저널에만 기록된 유저. users.json 의 기록이 오래된 것이라서,
+        # 캐시에서 내려오면 다음 스냅샷까지 한 줄짜리 JSON 문자열로 보관합니다. (저널 압축 주기만큼만 쌓임)
+        self._journal_ids = set()
+        self._journaled = {}
+        self._state_lock = threading.Lock()
+
+    def load_stocks(self):
+        return load_data(STOCK_FILE, DEFAULT_STOCKS)
+
+    def load_users(self):
+        """모든 유저를 딕셔너리 하나로 읽습니다. (SQLite 로 처음 옮길 때만 씁니다)"""
+        users = load_data(USER_FILE, {})
+        if self.use_journal:
+            self._replay_journal(users)
+        return users
+
+    def load_summaries(self):
+        """
+        ({user_id: (현금, {종목: 수량})}, [(주문 번호, user_id, 주문), ...]) 을 users.index 에서 읽어 돌려줍니다.
+        색인이 없거나 users.json 과 맞지 않을 때(예전 형식, 손으로 고친 파일 등)만 users.json 을 전부 읽어 다시 만들고,
+        저널에 남은 기록이 있으면 스냅샷에 합친 뒤 읽습니다.
+        """
+        journal = {}
+        if self.use_journal:
+            self._replay_journal(journal)
+        loaded = self._read_index()
+        if loaded is not None and not journal:
+            return loaded
+        if loaded is None:
+            print("유저 색인을 다시 만듭니다. (users.json 전체를 한 번 읽습니다)", file=sys.stderr)
+            users = load_data(USER_FILE, {})
+            users.update(journal)
+            self._rewrite(users, full=True)
+        else:
+            self._rewrite(journal)
+        self._reset_journal()
+        return self._read_index()
+
+    def load_user(self, user_id):
+        with self._state_lock:
+            raw = self._journaled.get(user_id)
+        if raw is not None:
+            return json.loads(raw)
+        with self._read_lock:
+            location = self._index.get(user_id)
+            if location is None:
+                return None
+            self._user_file.seek(location[0])
+            raw = self._user_file.read(location[1])
+        return json.loads(raw)
+
+    def release_user(self, user_id, user):
+        """캐시에서 내린 유저를 받습니다. (저장이 끝난 유저만 내려옵니다) users.json 에 최신 기록이 있으면 그냥 버립니다."""
+        with self._state_lock:
+            if user_id in self._journal_ids:
+                self._journaled[user_id] = _dumps_user(user)
+
+    def save_users(self, users):
+        self.write_users_snapshot(users)
+
+    def wants_users_snapshot(self, dirty_count, closing=False):
+        """이번 저장에 전체 유저 스냅샷이 필요한지 알려줍니다. (저널을 쓰지 않거나, 저널 압축 시점이거나, 종료하는 경우)"""
+        if closing:
+            return True
+        if not self.use_journal:
+            return dirty_count > 0
+        return self._journal_count + dirty_count >= JOURNAL_COMPACT_THRESHOLD
+
+    def write_batch(self, user_records, stocks_snapshot, dirty_stock_names, users_snapshot=None):
+        if dirty_stock_names:
+            write_json_atomic(STOCK_FILE, stocks_snapshot)
+        if users_snapshot is not None:
+            self.write_users_snapshot(users_snapshot)
+        elif user_records:
+            self._append_journal(user_records)
+
+    def write_users_snapshot(self, users):
+        """
+        유저 데이터를 users.json / users.index 에 반영하고 저널을 비웁니다.
+        users 에는 캐시에 있는 유저만 들어오며, 나머지 유저는 이전 users.json 의 기록과 요약을 그대로 옮겨 씁니다.
+        """
+        with self._state_lock:
+            changed = dict(self._journaled)
+        changed.update(users)
+        self._rewrite(changed)
+        with self._state_lock:
+            self._journaled.clear()
+            self._journal_ids.clear()
+        self._reset_journal()
+
+    def close(self):
+        if self._journal_file is not None:
+            self._journal_file.close()
+            self._journal_file = None
+        with self._read_lock:
+            if self._user_file is not None:
+                self._user_file.close()
+                self._user_file = None
+
+    # --- users.json 색인 ---
+    @staticmethod
+    def _fingerprint(filename):
+        """색인이 가리키는 users.json 이 맞는지 확인하는 값. os.replace 로 옮겨도 바뀌지 않습니다."""
+        stat = os.stat(filename)
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "inode": stat.st_ino}
+
+    def _read_index(self):
+        """users.index 를 읽어 (요약, 대기 주문) 을 돌려주고 위치 색인을 올립니다. users.json 과 맞지 않으면 None."""
+        if not os.path.exists(USER_INDEX_FILE) or not os.path.exists(USER_FILE):
+            return None
+        index, summaries, open_orders = {}, {}, []
+        trailer = None
+        try:
+            with open(USER_INDEX_FILE, "r", encoding="utf-8") as file:
+                for line in file:
+                    # 한 줄에 유저 한 명: user_id(JSON) \t 위치 \t 길이 \t 요약(JSON). 마지막 줄은 users.json 확인 값입니다.
+                    parts = line.rstrip("\n").split("\t", 3)
+                    if len(parts) == 1:
+                        trailer = json.loads(parts[0])
+                        continue
+                    user_id = json.loads(parts[0])
+                    index[user_id] = (int(parts[1]), int(parts[2]))
+                    _read_summary(json.loads(parts[3]), user_id, summaries, open_orders)
+        except (ValueError, IndexError, IOError) as e:
+            print(f"유저 색인 로드 오류 {USER_INDEX_FILE}: {e}", file=sys.stderr)
+            return None
+        if trailer != self._fingerprint(USER_FILE):
+            return None
+        with self._read_lock:
+            if self._user_file is not None:
+                self._user_file.close()
+            self._user_file = open(USER_FILE, "rb")
+            self._index = index
+        return summaries, open_orders
+
+    def _iter_snapshot(self):
+        """현재 users.json 의 유저를 파일 순서대로 (user_id, 유저 JSON 바이트, 요약 문자열) 로 돌려줍니다. 파싱은 하지 않습니다."""
+        with open(USER_INDEX_FILE, "r", encoding="utf-8") as index_file, open(USER_FILE, "rb") as data_file:
+            for line in index_file:
+                parts = line.rstrip("\n").split("\t", 3)
+                if len(parts) < 4:
+                    continue
+                data_file.seek(int(parts[1]))
+                yield json.loads(parts[0]), data_file.read(int(parts[2])), parts[3]
+
+    @staticmethod
+    def _encode(user):
+        if isinstance(user, str):
+            user = json.loads(user)
+        summary = json.dumps(_summary_record(user), ensure_ascii=False, separators=(",", ":"))
+        return _dumps_user(user).encode("utf-8"), summary
+
+    def _rewrite(self, changed, full=False):
+        """
+        changed(user_id -> 유저 데이터 또는 한 줄 JSON)를 반영해 users.json 과 users.index 를 새로 씁니다.
+        바뀌지 않은 유저는 이전 파일에서 바이트 그대로 옮기므로 파싱하지 않습니다. full 이면 changed 가 전체 유저입니다.
+        """
+        pending = dict(changed)
+        index = {}
+        temp_data, temp_index = f"{USER_FILE}.tmp", f"{USER_INDEX_FILE}.tmp"
+        with open(temp_index, "w", encoding="utf-8") as index_file:
+            with open(temp_data, "wb") as data_file:
+                data_file.write(b"{\n")
+                position = 2
+
+                def write_entry(user_id, raw, summary):
+                    nonlocal position
+                    key = json.dumps(user_id, ensure_ascii=False)
+                    head = ((",\n" if index else "") + f"{key}: ").encode("utf-8")
+                    data_file.write(head)
+                    data_file.write(raw)
+                    index[user_id] = (position + len(head), len(raw))
+                    index_file.write(f"{key}\t{position + len(head)}\t{len(raw)}\t{summary}\n")
+                    position += len(head) + len(raw)
+
+                if not full:
+                    for user_id, raw, summary in self._iter_snapshot():
+                        if user_id in pending:
+                            write_entry(user_id, *self._encode(pending.pop(user_id)))
+                        else:
+                            write_entry(user_id, raw, summary)
+                for user_id, user in pending.items():
+                    write_entry(user_id, *self._encode(user))
+                data_file.write(b"\n}\n")
+            index_file.write(json.dumps(self._fingerprint(temp_data)) + "\n")
+        # 색인을 먼저 바꿔도, users.json 이 바뀌기 전에 종료되면 확인 값이 맞지 않아 다음 시작 때 다시 만듭니다.
+        with self._read_lock:
+            os.replace(temp_index, USER_INDEX_FILE)
+            os.replace(temp_data, USER_FILE)
+            if self._user_file is not None:
+                self._user_file.close()
+            self._user_file = open(USER_FILE, "rb")
+            self._index = index
+
+    # --- 유저 저널 (append-only) ---
+    def _reset_journal(self):
+        # 스냅샷 교체가 끝난 뒤에만 저널을 비워야, 그 사이에 종료되어도 기록이 유실되지 않습니다.
+        if not self.use_journal:
+            return
+        if self._journal_file is not None:
+            self._journal_file.close()
+            self._journal_file = None
+        open(USER_JOURNAL_FILE, "w", encoding="utf-8").close()
+        self._journal_count = 0
+
+    def _replay_journal(self, snapshot):
+        """스냅샷 위에 저널 기록을 순서대로 덮어씁니다. 기록은 유저 상태 전체라서 여러 번 적용해도 결과가 같습니다."""
+        if not os.path.exists(USER_JOURNAL_FILE):
+            return 0
+        replayed = 0
+        with open(USER_JOURNAL_FILE, "r", encoding="utf-8") as file:
+            for line_no, line in enumerate(file, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 종료 직전에 쓰다 만 마지막 줄일 수 있으므로 건너뜁니다.
+                    print(f"저널 {line_no}번째 줄을 읽을 수 없어 건너뜁니다.", file=sys.stderr)
+                    continue
+                snapshot[record["u"]] = record["d"]
+                replayed += 1
+        return replayed
+
+    def _append_journal(self, user_records):
+        """유저별 현재 상태를 한 줄짜리 JSON 기록으로 저널에 덧붙입니다."""
+        lines = "".join(json.dumps({"u": user_id, "d": user}, ensure_ascii=False, separators=(",", ":")) + "\n"
+                        for user_id, user in user_records.items())
+        if self._journal_file is None:
+            self._journal_file = open(USER_JOURNAL_FILE, "a", encoding="utf-8")
+        self._journal_file.write(lines)
+        self._journal_file.flush()
+        self._journal_count += len(user_records)
+        with self._state_lock:
+            self._journal_ids.update(user_records)
+
+
+class SQLiteBackend:
+    """SQLite 저장소. 유저/보유 주식/종목을 테이블로 나눠 변경된 행만 트랜잭션으로 갱신합니다."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            balance REAL NOT NULL,
+            last_claim_date TEXT,
+            extra TEXT
+        );
+        CREATE TABLE IF NOT EXISTS holdings (
+            user_id TEXT NOT NULL,
+            stock_name TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            avg_price REAL NOT NULL,
+            PRIMARY KEY (user_id, stock_name)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_holdings_stock ON holdings (stock_name);
+        CREATE TABLE IF NOT EXISTS user_summaries (
+            user_id TEXT PRIMARY KEY,
+            cash REAL NOT NULL,
+            holdings TEXT NOT NULL,
+            orders TEXT
+        );
+        CREATE TABLE IF NOT EXISTS stocks (
+            name TEXT PRIMARY KEY,
+            price REAL NOT NULL,
+            sector TEXT NOT NULL,
+            volatility REAL NOT NULL,
+            total_shares INTEGER NOT NULL,
+            available_shares INTEGER NOT NULL
+        );
+    """
+    # users 테이블의 고정 컬럼으로 저장되지 않는 나머지 키는 extra 컬럼에 JSON으로 보관합니다.
+    USER_COLUMNS = ("balance", "stocks", "last_claim_date")
+
+    def __init__(self, path=SQLITE_FILE):
+        self.path = path
+        # 로드는 메인 스레드에서, 저장은 백그라운드 저장 스레드에서 하므로 스레드 검사를 끕니다. (동시에 쓰지는 않음)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        # 캐시에 없는 유저는 거래 스레드에서 바로 읽어 오므로, 스레드마다 읽기 전용 연결을 따로 둡니다.
+        self._local = threading.local()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+
+    def load_stocks(self):
+        rows = self.conn.execute("SELECT name, price, sector, volatility, total_shares, available_shares FROM stocks").fetchall()
+        if not rows:
+            # 처음 SQLite로 전환할 때는 기존 JSON 데이터를 가져옵니다.
+            imported = load_data(STOCK_FILE, DEFAULT_STOCKS)
+            with self.conn:
+                self._write_stocks(imported, imported.keys())
+            return imported
+        return {name: {"price": price, "sector": sector, "volatility": volatility,
+                       "total_shares": total_shares, "available_shares": available_shares}
+                for name, price, sector, volatility, total_shares, available_shares in rows}
+
+    def load_summaries(self):
+        """({user_id: (현금, {종목: 수량})}, [(주문 번호, user_id, 주문), ...]) 을 user_summaries 테이블에서 읽어 돌려줍니다."""
+        if self.conn.execute("SELECT 1 FROM users LIMIT 1").fetchone() is None:
+            self.save_users(JsonBackend(use_journal=USE_USER_JOURNAL).load_users())
+        elif self.conn.execute("SELECT 1 FROM user_summaries LIMIT 1").fetchone() is None:
+            # 요약 테이블이 생기기 전에 만든 DB 는 한 번만 전체 유저를 훑어 채웁니다.
+            rows = [(user_id, *self._summary_row(user)) for user_id, user in self._iter_users()]
+            with self.conn:
+                self.conn.executemany("INSERT INTO user_summaries (user_id, cash, holdings, orders) VALUES (?, ?, ?, ?)", rows)
+        summaries, open_orders = {}, []
+        for user_id, cash, holdings, orders in self.conn.execute("SELECT user_id, cash, holdings, orders FROM user_summaries"):
+            record = [cash, json.loads(holdings)]
+            if orders:
+                record.append(json.loads(orders))
+            _read_summary(record, user_id, summaries, open_orders)
+        return summaries, open_orders
+
+    def load_user(self, user_id):
+        reader = self._reader()
+        row = reader.execute("SELECT balance, last_claim_date, extra FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return None
+        user = self._row_to_user(*row)
+        for stock_name, quantity, avg_price in reader.execute(
+                "SELECT stock_name, quantity, avg_price FROM holdings WHERE user_id = ?", (user_id,)):
+            user["stocks"][stock_name] = [quantity, avg_price]
+        return user
+
+    def release_user(self, user_id, user):
+        pass  # 저장이 끝난 유저만 내려오므로 테이블에 이미 최신 상태가 있습니다.
+
+    def save_users(self, users):
+        with self.conn:
+            for user_id, user in users.items():
+                self._write_user(user_id, user)
+
+    def wants_users_snapshot(self, dirty_count, closing=False):
+        return False
+
+    def write_batch(self, user_records, stocks_snapshot, dirty_stock_names, users_snapshot=None):
+        """변경된 유저와 종목 행만 하나의 트랜잭션으로 갱신합니다."""
+        with self.conn:
+            for user_id, user in user_records.items():
+                self._write_user(user_id, user)
+            self._write_stocks(stocks_snapshot, dirty_stock_names)
+
+    def close(self):
+        self.conn.close()
+        with self._readers_lock:
+            for reader in self._readers:
+                reader.close()
+            self._readers.clear()
+
+    def _reader(self):
+        reader = getattr(self._local, "conn", None)
+        if reader is None:
+            reader = self._local.conn = sqlite3.connect(self.path, check_same_thread=False)
+            with self._readers_lock:
+                self._readers.append(reader)
+        return reader
+
+    def _iter_users(self):
+        """모든 유저를 (user_id, 유저 데이터) 로 한 명씩 돌려줍니다. 두 테이블을 user_id 순으로 나란히 읽어 전체를 메모리에 올리지 않습니다."""
+        holdings = itertools.groupby(
+            self.conn.execute("SELECT user_id, stock_name, quantity, avg_price FROM holdings ORDER BY user_id"),
+            key=lambda row: row[0])
+        pending = next(holdings, None)
+        for user_id, balance, last_claim_date, extra in self.conn.execute(
+                "SELECT user_id, balance, last_claim_date, extra FROM users ORDER BY user_id"):
+            user = self._row_to_user(balance, last_claim_date, extra)
+            while pending is not None and pending[0] < user_id:
+                pending = next(holdings, None)
+            if pending is not None and pending[0] == user_id:
+                user["stocks"] = {stock_name: [quantity, avg_price] for _, stock_name, quantity, avg_price in pending[1]}
+                pending = next(holdings, None)
+            yield user_id, user
+
+    def _row_to_user(self, balance, last_claim_date, extra):
+        user = json.loads(extra) if extra else {}
+        user.update({"balance": balance, "stocks": {}, "last_claim_date": last_claim_date})
+        return user
+
+    @staticmethod
+    def _summary_row(user):
+        record = _summary_record(user)
+        orders = json.dumps(record[2], ensure_ascii=False) if len(record) > 2 else None
+        return record[0], json.dumps(record[1], ensure_ascii=False), orders
+
+    def _write_user(self, user_id, user):
+        extra = {key: value for key, value in user.items() if key not in self.USER_COLUMNS}
+        self.conn.execute(
+            "INSERT INTO users (user_id, balance, last_claim_date, extra) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET balance=excluded.balance, last_claim_date=excluded.last_claim_date, extra=excluded.extra",
+            (user_id, user.get("balance", 0), user.get("last_claim_date"), json.dumps(extra, ensure_ascii=False) if extra else None))
+        # 유저 한 명의 보유 종목은 많지 않으므로 해당 유저의 행만 지우고 다시 넣습니다.
+        self.conn.execute("DELETE FROM holdings WHERE user_id = ?", (user_id,))
+        self.conn.executemany("INSERT INTO holdings (user_id, stock_name, quantity, avg_price) VALUES (?, ?, ?, ?)",
+                              [(user_id, name, quantity, avg_price) for name, (quantity, avg_price) in user.get("stocks", {}).items()])
+        # 시작할 때 랭킹을 다시 계산하지 않도록 요약도 같은 트랜잭션에서 갱신합니다.
+        self.conn.execute(
+            "INSERT INTO user_summaries (user_id, cash, holdings, orders) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET cash=excluded.cash, holdings=excluded.holdings, orders=excluded.orders",
+            (user_id, *self._summary_row(user)))
+
+    def _write_stocks(self, stocks, names):
+        self.conn.executemany(
+            "INSERT INTO stocks (name, price, sector, volatility, total_shares, available_shares) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET price=excluded.price, sector=excluded.sector, volatility=excluded.volatility, "
+            "total_shares=excluded.total_shares, available_shares=excluded.available_shares",
+            [(name, stocks[name]["price"], stocks[name]["sector"], stocks[name]["volatility"],
+              stocks[name]["total_shares"], stocks[name]["available_shares"]) for name in names if name in stocks])
+
+
+# --- 종목 테이블 (열 단위 저장) ---
+class StockRow(MutableMapping):
+    """StockTable 의 한 행을 기존 딕셔너리처럼 다룰 수 있게 해 주는 뷰. 값은 테이블 배열에 바로 읽고 씁니다."""
+    KEYS = ("price", "sector", "volatility", "total_shares", "available_shares")
+
+    __slots__ = ("_table", "_i")
+
+    def __init__(self, table, index):
+        self._table = table
+        self._i = index
+
+    def __getitem__(self, key):
+        if key == "sector":
+            return self._table.sector_names[self._table.sector_code[self._i]]
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self._table, key)[self._i]
+
+    def __setitem__(self, key, value):
+        if key == "sector":
+            self._table.sector_code[self._i] = self._table.sector_code_of(value)
+        elif key in self.KEYS:
+            getattr(self._table, key)[self._i] = value
+        else:
+            raise KeyError(key)
+
+    def __delitem__(self, key):
+        raise TypeError("종목 필드는 삭제할 수 없습니다.")
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class StockTable(Mapping):
+    """
+    종목 데이터를 종목별 딕셔너리 대신 필드별 배열(가격, 변동성, 발행량, 유통량, 분야 코드)로 보관합니다.
+    시세 갱신은 열 단위로 한 번에 계산하고, bot.py 등 기존 코드는 stocks['Apple']['price'] 처럼 그대로 씁니다.
+    """
+    def __init__(self, data):
+        self.names = []
+        self._index = {}
+        self.price = array('d')
+        self.volatility = array('d')
+        self.total_shares = array('q')
+        self.available_shares = array('q')
+        self.sector_code = array('i')
+        self.sector_names = []
+        self._sector_codes = {}
+        for name, row in data.items():
+            self.add(name, row)
+
+    def sector_code_of(self, sector):
+        if sector not in self._sector_codes:
+            self._sector_codes[sector] = len(self.sector_names)
+            self.sector_names.append(sector)
+        return self._sector_codes[sector]
+
+    def add(self, name, row):
+        self._index[name] = len(self.names)
+        self.names.append(name)
+        self.price.append(row["price"])
+        self.volatility.append(row.get("volatility", 1.0))
+        self.total_shares.append(row["total_shares"])
+        self.available_shares.append(row["available_shares"])
+        self.sector_code.append(self.sector_code_of(row["sector"]))
+
+    def __getitem__(self, name):
+        return StockRow(self, self._index[name])
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def price_of(self, name, default=0):
+        """행 뷰를 만들지 않고 가격만 바로 읽습니다."""
+        index = self._index.get(name)
+        return self.price[index] if index is not None else default
+
+    def to_dict(self):
+        return {name: dict(StockRow(self, i)) for i, name in enumerate(self.names)}
+
+    def __deepcopy__(self, memo):
+        # 저장용 스냅샷은 일반 딕셔너리로 만듭니다.
+        return self.to_dict()
+
+    def apply_tick(self, sector_bonus, stock_bonus=None):
+        """
+        전체 종목의 가격을 한 번에 갱신하고 (변동액 목록, 변동률 목록)을 돌려줍니다.
+        sector_bonus 는 분야 코드별 추가 변동률(%) 목록, stock_bonus 는 {종목: 추가 변동률(%)} 입니다.
+        """
+        uniform = random.uniform
+        base_changes = [uniform(-2.0 * v, 2.0 * v) for v in self.volatility]
+        demand_pressures = [((total - available) / total) * 5.0 if total > 0 else 0.0
+                            for total, available in zip(self.total_shares, self.available_shares)]
+        bonuses = [sector_bonus[code] for code in self.sector_code]
+        for name, bonus in (stock_bonus or {}).items():
+            if name in self._index:
+                bonuses[self._index[name]] += bonus
+        percent_changes = list(map(sum, zip(base_changes, demand_pressures, bonuses)))
+        change_amounts = [price * (percent / 100) for price, percent in zip(self.price, percent_changes)]
+        self.price = array('d', [max(1.0, round(price + change, 2)) for price, change in zip(self.price, change_amounts)])
+        return change_amounts, percent_changes
+
+
+# --- 유저 저장소 (필요할 때 읽기 + 최근 유저 캐시) ---
+class UserStore:
+    """
+    users 딕셔너리 대신 쓰는 유저 저장소. 최근에 쓴 유저 capacity 명만 메모리에 두고, 나머지는 처음 찾을 때 백엔드에서 읽습니다.
+    유저를 캐시에서 내릴 때는 저장이 끝났고(is_clean) 진행 중인 트랜잭션이 잡고 있지 않은(pin) 유저만 내립니다.
+    전체 유저 목록(user_id)만은 항상 들고 있어서, 없는 유저를 찾느라 저장소를 뒤지지 않습니다.
+    """
+    def __init__(self, backend, capacity=USER_CACHE_SIZE, is_clean=None, on_evict=None):
+        self.capacity = capacity
+        self.is_clean = is_clean or (lambda user_id: True)
+        self.on_evict = on_evict or (lambda user_id: None)  # 유저를 내린 뒤 유저별 부가 정보를 정리할 때
+        self._backend = backend
+        self._ids = set()
+        self._resident = OrderedDict()  # user_id -> 유저 데이터 (오래 안 쓴 순)
+        self._touched = {}              # user_id -> 마지막으로 쓴 시각
+        self._pins = {}                 # user_id -> 이 유저를 잠그고 있는 트랜잭션 수
+        # 백엔드에서 읽는 중인 유저. 읽기는 잠금 밖에서 하고, 같은 유저를 찾는 다른 스레드는 이 이벤트를 기다립니다.
+        self._loading = {}              # user_id -> threading.Event
+        self._lock = threading.Lock()
+
+    def register_all(self, user_ids):
+        """저장소에 있는 유저들을 목록에 올립니다. (시작할 때 저장해 둔 요약을 읽은 뒤 호출)"""
+        self._ids.update(user_ids)
+
+    def __contains__(self, user_id):
+        return user_id in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(list(self._ids))
+
+    def __getitem__(self, user_id):
+        user = self.get(user_id)
+        if user is None:
+            raise KeyError(user_id)
+        return user
+
+    def get(self, user_id, default=None):
+        while True:
+            with self._lock:
+                user = self._resident.get(user_id)
+                if user is not None:
+                    self._resident.move_to_end(user_id)
+                    self._touched[user_id] = time.monotonic()
+                    return user
+                if user_id not in self._ids:
+                    return default
+                loading = self._loading.get(user_id)
+                if loading is None:
+                    loading = self._loading[user_id] = threading.Event()
+                    break
+            # 다른 스레드가 읽는 중이면 끝날 때까지 기다렸다가 캐시에서 다시 찾습니다.
+            loading.wait()
+        # 저장소 읽기(SQLite 조회, 파일 읽기)는 전체 잠금 밖에서 해서 다른 유저의 조회를 막지 않습니다.
+        user = None
+        try:
+            user = self._backend.load_user(user_id)
+        finally:
+            with self._lock:
+                del self._loading[user_id]
+                if user is not None:
+                    metrics.USER_LOADS.inc()
+                    self._resident[user_id] = user
+                    self._touched[user_id] = time.monotonic()
+                    self._evict_overflow()
+            loading.set()
+        return user if user is not None else default
+
+    def peek(self, user_id):
+        """캐시에 있을 때만 돌려주고, 없으면 저장소에서 읽지 않고 None."""
+        return self._resident.get(user_id)
+
+    def __setitem__(self, user_id, user):
+        with self._lock:
+            self._ids.add(user_id)
+            self._resident[user_id] = user
+            self._resident.move_to_end(user_id)
+            self._touched[user_id] = time.monotonic()
+            self._evict_overflow()
+
+    def resident_items(self):
+        with self._lock:
+            return list(self._resident.items())
+
+    @property
+    def resident_count(self):
+        return len(self._resident)
+
+    # --- 트랜잭션이 잡고 있는 유저 ---
+    def pin(self, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._pins[user_id] = self._pins.get(user_id, 0) + 1
+
+    def unpin(self, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                count = self._pins.pop(user_id) - 1
+                if count:
+                    self._pins[user_id] = count
+
+    # --- 캐시에서 내리기 ---
+    def _evict(self, limit, cutoff=None):
+        """
+        오래 안 쓴 순으로 최대 limit 명을 내리고, 내린 유저 수를 돌려줍니다. (self._lock 을 잡은 채 호출)
+        cutoff 가 있으면 그 뒤에 쓴 유저에서 멈춥니다. 저장 대기 중이거나 사용 중인 유저는 순서를 그대로 둔 채 건너뛰어,
+        얼마나 오래 안 쓰였는지가 가려지지 않게 합니다.
+        """
+        victims = []
+        skipped = 0
+        for user_id in self._resident:
+            if len(victims) >= limit or skipped >= USER_EVICT_SCAN:
+                break
+            if cutoff is not None and self._touched[user_id] > cutoff:
+                break
+            if self._pins.get(user_id) or not self.is_clean(user_id):
+                skipped += 1
+            else:
+                victims.append(user_id)
+        for user_id in victims:
+            user = self._resident.pop(user_id)
+            del self._touched[user_id]
+            self._backend.release_user(user_id, user)
+            self.on_evict(user_id)
+        metrics.USERS_RESIDENT.set(len(self._resident))
+        return len(victims)
+
+    def _evict_overflow(self):
+        overflow = len(self._resident) - self.capacity
+        if overflow > 0:
+            self._evict(overflow)
+
+    def evict_idle(self, max_idle=USER_IDLE_SECONDS):
+        """max_idle 초 넘게 쓰지 않은 유저를 내리고, 내린 유저 수를 돌려줍니다. (저장 스레드가 주기적으로 호출)"""
+        with self._lock:
+            return self._evict(len(self._resident), cutoff=time.monotonic() - max_idle)
+
+
+def _create_backend():
+    if STORAGE_BACKEND == "sqlite":
+        return SQLiteBackend(SQLITE_FILE)
+    if STORAGE_BACKEND != "json":
+        print(f"알 수 없는 저장소 '{STORAGE_BACKEND}', json 저장소를 사용합니다.", file=sys.stderr)
+    return JsonBackend(use_journal=USE_USER_JOURNAL)
+
 # --- 데이터 초기화 ---
-stocks = load_data(STOCK_FILE, DEFAULT_STOCKS)
-users = load_data(USER_FILE, {})
+_load_started = time.perf_counter()
+_backend = _create_backend()
+stocks = StockTable(_backend.load_stocks())
+# 시작할 때는 저장해 둔 유저 요약만 읽고(아래 랭킹 초기화), 실제 유저 데이터는 쓰일 때 읽어 옵니다.
+users = UserStore(_backend, is_clean=lambda user_id: _persistence.is_user_clean(user_id),
+                  on_evict=lambda user_id: _forget_user(user_id))
+
+# --- 트랜잭션 잠금 ---
+# 유저는 해시로 나눈 잠금 묶음(stripe)을, 종목은 종목별 잠금을 사용합니다.
+# 여러 잠금을 잡을 때는 항상 '유저 잠금(번호 순) → 종목 잠금(이름 순)' 순서로 잡아 교착 상태를 막습니다.
+# 랭킹/시세 기록 등의 내부 잠금은 항상 이 잠금들보다 안쪽에서만 잡습니다.
+_users_lock = threading.Lock()  # users 에 새 유저를 추가하거나 캐시 전체를 순회할 때
+_user_locks = [threading.RLock() for _ in range(USER_LOCK_STRIPES)]
+_stock_locks = {name: threading.RLock() for name in stocks.names}
+
+def _user_lock(user_id):
+    return _user_locks[hash(user_id) % USER_LOCK_STRIPES]
+
+@contextlib.contextmanager
+def transaction(user_ids=(), stock_names=()):
+    """
+    지정한 유저/종목을 다른 스레드가 동시에 바꾸지 못하게 잠급니다.
+    서로 다른 유저·종목에 대한 거래는 워커 스레드에서 동시에 진행될 수 있습니다.
+    """
+    stripes = sorted({hash(user_id) % USER_LOCK_STRIPES for user_id in user_ids})
+    locks = [_user_locks[i] for i in stripes] + [_stock_locks[name] for name in sorted(set(stock_names)) if name in _stock_locks]
+    # 잠금을 잡는 동안 이 유저들이 캐시에서 내려가지 않게 합니다.
+    users.pin(user_ids)
+    for lock in locks:
+        lock.acquire()
+    try:
+        yield
+    finally:
+        for lock in reversed(locks):
+            lock.release()
+        users.unpin(user_ids)
+
+def _user_transaction(with_stock=False):
+    """첫 번째 인자(user_id)의 유저를, with_stock 이면 두 번째 인자(종목 이름)도 함께 잠근 채 함수를 실행합니다."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(user_id, *args, **kwargs):
+            stock_names = args[:1] if with_stock else ()
+            with transaction((user_id,), stock_names):
+                return func(user_id, *args, **kwargs)
+        return wrapper
+    return decorator
+
+# --- 백그라운드 저장 ---
+class PersistenceWorker:
+    """변경된 유저/종목을 표시해 두었다가, 이벤트 루프 밖의 스레드에서 일정 간격으로 한 번에 저장합니다."""
+
+    def __init__(self, backend, interval_ms=FLUSH_INTERVAL_MS):
+        self.backend = backend
+        self.interval = interval_ms / 1000
+        self._dirty_users = set()
+        self._flushing_users = set()  # 복사해서 쓰는 중이라 아직 저장이 끝나지 않은 유저
+        self._dirty_stocks = set()
+        self._dirty_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="stock-persistence", daemon=True)
+        self._thread.start()
+
+    def mark_users(self, *user_ids):
+        with self._dirty_lock:
+            self._dirty_users.update(user_ids)
+        self._schedule()
+
+    def is_user_clean(self, user_id):
+        """저장할 변경분이 남아 있지 않은 유저인지. 이런 유저만 캐시에서 내릴 수 있습니다."""
+        with self._dirty_lock:
+            return user_id not in self._dirty_users and user_id not in self._flushing_users
+
+    def mark_stocks(self, *names):
+        with self._dirty_lock:
+            self._dirty_stocks.update(names or stocks.keys())
+        self._schedule()
+
+    def _schedule(self):
+        if self.running:
+            self._wake.set()
+        else:
+            # 저장 스레드 없이 모듈만 쓰는 경우(스크립트 등)에는 바로 저장합니다.
+            self.flush()
+
+    def flush(self, force_snapshot=False):
+        """표시된 변경분을 스냅샷으로 복사해 한 번에 저장합니다."""
+        with self._dirty_lock:
+            user_ids, self._dirty_users = self._dirty_users, set()
+            stock_names, self._dirty_stocks = self._dirty_stocks, set()
+            self._flushing_users |= user_ids
+        full_snapshot = self.backend.wants_users_snapshot(len(user_ids), closing=force_snapshot)
+        if not user_ids and not stock_names and not full_snapshot:
+            return
+        try:
+            self._write(user_ids, stock_names, full_snapshot)
+        finally:
+            with self._dirty_lock:
+                self._flushing_users -= user_ids
+
+    def _write(self, user_ids, stock_names, full_snapshot):
+        user_records = {}
+        for user_id in user_ids:
+            with transaction((user_id,)):
+                # 변경 표시된 유저는 캐시에서 내려가지 않으므로 항상 캐시에 있습니다.
+                user = users.peek(user_id)
+                if user is not None:
+                    user_records[user_id] = copy.deepcopy(user)
+        stocks_snapshot = None
+        if stock_names:
+            with transaction(stock_names=stocks.names):
+                stocks_snapshot = copy.deepcopy(stocks)
+        users_snapshot = _snapshot_all_users() if full_snapshot else None
+        started = time.perf_counter()
+        try:
+            self.backend.write_batch(user_records, stocks_snapshot, stock_names, users_snapshot)
+            metrics.STORAGE_FLUSH_DURATION.observe(time.perf_counter() - started)
+        except (IOError, sqlite3.Error) as e:
+            print(f"데이터 저장 오류: {e}", file=sys.stderr)
+            # 실패한 변경분은 다음 저장 때 다시 시도합니다.
+            with self._dirty_lock:
+                self._dirty_users.update(user_ids)
+                self._dirty_stocks.update(stock_names)
+
+    def stop(self):
+        """저장 스레드를 멈추고 남은 변경분을 모두 저장합니다."""
+        if self.running:
+            self._stopping.set()
+            self._wake.set()
+            self._thread.join()
+        self.flush(force_snapshot=True)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            if self._wake.wait(USER_IDLE_CHECK_SECONDS):
+                # 잠시 기다리는 동안 들어온 변경을 모아서 한 번에 씁니다.
+                self._stopping.wait(self.interval)
+                self._wake.clear()
+                self.flush()
+            users.evict_idle()
+
+def _snapshot_all_users():
+    """캐시에 올라와 있는 유저들의 스냅샷. 캐시에 없는 유저는 백엔드가 이미 최신 상태로 가지고 있습니다."""
+    with _users_lock:
+        items = users.resident_items()
+    snapshot = {}
+    for user_id, user in items:
+        with transaction((user_id,)):
+            snapshot[user_id] = copy.deepcopy(user)
+    return snapshot
+
+_persistence = PersistenceWorker(_backend)
+
+def start_persistence():
+    """백그라운드 저장 스레드를 시작합니다. (봇 시작 시 호출)"""
+    _persistence.start()
+    atexit.register(stop_persistence)
+
+def stop_persistence():
+    """남은 변경분을 저장하고 저장소를 닫습니다. (봇 종료 시 호출)"""
+    if _persistence.backend is None:
+        return
+    _persistence.stop()
+    _persistence.backend.close()
+    _persistence.backend = None
+
+def mark_user_dirty(user_id):
+    _persistence.mark_users(user_id)
+
+def mark_stocks_dirty(*names):
+    """변경된 종목을 표시합니다. 이름을 주지 않으면 전체 종목을 저장합니다."""
+    _persistence.mark_stocks(*names)
 
 def save_users():
-    save_data(USER_FILE, users)
+    """전체 유저 데이터를 즉시 저장합니다. (캐시에 없는 유저는 이미 저장되어 있습니다)"""
+    _backend.save_users(_snapshot_all_users())
+
+# --- 랭킹 인덱스 ---
+class _SortedList:
+    """버킷으로 나눈 정렬 리스트. 버킷 크기를 펜윅 트리로 관리해서 삽입/삭제/순위 조회가 O(log N) 수준입니다."""
+    LOAD = 512
+
+    def __init__(self, items=()):
+        self._reset(sorted(items))
+
+    def _reset(self, items):
+        self._buckets = [items[i:i + self.LOAD] for i in range(0, len(items), self.LOAD)]
+        self._maxes = [bucket[-1] for bucket in self._buckets]
+        self._len = len(items)
+        self._build_index()
+
+    def _build_index(self):
+        size = len(self._buckets)
+        tree = [0] * (size + 1)
+        for i, bucket in enumerate(self._buckets, 1):
+            tree[i] += len(bucket)
+            parent = i + (i & -i)
+            if parent <= size:
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _index_add(self, bucket_pos, delta):
+        i = bucket_pos + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _count_before(self, bucket_pos):
+        total, i = 0, bucket_pos
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self._buckets)
+
+    def add(self, item):
+        if not self._buckets:
+            self._reset([item])
+            return
+        pos = min(bisect.bisect_left(self._maxes, item), len(self._buckets) - 1)
+        bucket = self._buckets[pos]
+        bisect.insort(bucket, item)
+        self._maxes[pos] = bucket[-1]
+        self._len += 1
+        if len(bucket) > 2 * self.LOAD:
+            self._buckets[pos:pos + 1] = [bucket[:self.LOAD], bucket[self.LOAD:]]
+            self._maxes[pos:pos + 1] = [self._buckets[pos][-1], self._buckets[pos + 1][-1]]
+            self._build_index()
+        else:
+            self._index_add(pos, 1)
+
+    def remove(self, item):
+        pos = bisect.bisect_left(self._maxes, item)
+        bucket = self._buckets[pos]
+        del bucket[bisect.bisect_left(bucket, item)]
+        self._len -= 1
+        if bucket:
+            self._maxes[pos] = bucket[-1]
+            self._index_add(pos, -1)
+        else:
+            del self._buckets[pos], self._maxes[pos]
+            self._build_index()
+
+    def index(self, item):
+        pos = bisect.bisect_left(self._maxes, item)
+        return self._count_before(pos) + bisect.bisect_left(self._buckets[pos], item)
+
+
+class Leaderboard:
+    """
+    유저별 총 자산 순위를 항상 정렬된 상태로 유지합니다.
+    유저마다 (현금, {종목: 수량}) 요약만 들고 있고, 종목별 보유자 색인으로 주가가 바뀐 종목의 보유자만 다시 계산합니다.
+    """
+    # 영향받는 유저가 전체의 이 비율을 넘으면 하나씩 고치는 대신 한 번에 다시 정렬합니다.
+    REBUILD_RATIO = 0.25
+
+    def __init__(self):
+        self._order = _SortedList()
+        self._keys = {}       # user_id -> (-총자산, user_id)
+        self._summaries = {}  # user_id -> (현금, {종목: 수량})
+        self._holders = {}    # 종목 -> {user_id, ...}
+        self._rebuild_changed = None  # 잠금 밖에서 다시 정렬하는 동안 순위가 바뀐 유저
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _assets(self, summary):
+        cash, holdings = summary
+        return cash + sum(quantity * stocks.price_of(name) for name, quantity in holdings.items())
+
+    def rebuild(self, summaries):
+        """{user_id: (현금, {종목: 수량})} 요약으로 전체 순위를 다시 만듭니다."""
+        with self._lock:
+            self._summaries = summaries
+            self._holders = {}
+            for user_id, (_, holdings) in self._summaries.items():
+                for name in holdings:
+                    self._holders.setdefault(name, set()).add(user_id)
+            self._keys = {user_id: (-self._assets(summary), user_id) for user_id, summary in self._summaries.items()}
+            self._order = _SortedList(self._keys.values())
+
+    def update_user(self, user_id, user):
+        """잔액이나 보유 주식이 바뀐 유저 한 명의 순위를 갱신합니다."""
+        with self._lock:
+            summary = _summarize_user(user)
+            old = self._summaries.get(user_id)
+            if old is not None:
+                for name in old[1].keys() - summary[1].keys():
+                    self._holders[name].discard(user_id)
+            for name in summary[1]:
+                self._holders.setdefault(name, set()).add(user_id)
+            self._summaries[user_id] = summary
+            self._reposition(user_id)
+
+    def refresh_prices(self, names=None):
+        """
+        주가가 바뀐 종목들의 보유자만 다시 계산합니다. names 가 없으면 전체 종목.
+        대부분을 다시 계산해야 하면 잠금 밖에서 새로 정렬한 뒤 바꿔 끼워서, 그동안에도 랭킹 조회와 유저 갱신이 멈추지 않습니다.
+        시세 갱신 스레드 하나에서만 호출됩니다.
+        """
+        with self._lock:
+            names = self._holders.keys() if names is None else names
+            affected = set()
+            for name in names:
+                affected |= self._holders.get(name, set())
+            if len(affected) <= len(self._keys) * self.REBUILD_RATIO:
+                for user_id in affected:
+                    self._reposition(user_id)
+                return
+            # 요약은 바뀔 때마다 새 튜플로 교체되므로 딕셔너리만 얕게 복사하면 됩니다.
+            summaries = dict(self._summaries)
+            self._rebuild_changed = set()
+        keys = {user_id: (-self._assets(summary), user_id) for user_id, summary in summaries.items()}
+        order = _SortedList(keys.values())
+        with self._lock:
+            changed, self._rebuild_changed = self._rebuild_changed, None
+            # 정렬하는 동안 바뀐 유저만 새 목록에 다시 반영합니다.
+            for user_id in changed:
+                stale = keys.pop(user_id, None)
+                if stale is not None:
+                    order.remove(stale)
+                keys[user_id] = (-self._assets(self._summaries[user_id]), user_id)
+                order.add(keys[user_id])
+            self._keys, self._order = keys, order
+
+    def _reposition(self, user_id):
+        if self._rebuild_changed is not None:
+            self._rebuild_changed.add(user_id)
+        old_key = self._keys.get(user_id)
+        new_key = (-self._assets(self._summaries[user_id]), user_id)
+        if old_key == new_key:
+            return
+        if old_key is not None:
+            self._order.remove(old_key)
+        self._order.add(new_key)
+        self._keys[user_id] = new_key
+
+    def top(self, limit):
+        with self._lock:
+            return [(user_id, -neg_assets) for neg_assets, user_id in itertools.islice(self._order, limit)]
+
+    def rank(self, user_id):
+        """1부터 시작하는 순위. 랭킹에 없으면 None."""
+        with self._lock:
+            key = self._keys.get(user_id)
+            return self._order.index(key) + 1 if key is not None else None
+
+
+def _summarize_user(user):
+    """(현금, {종목: 수량}) 요약. 지정가 주문에 묶인 현금과 주식도 유저 자산에 포함합니다."""
+    cash = user.get("balance", 0)
+    holdings = {name: data[0] for name, data in user.get("stocks", {}).items()}
+    for order in user.get("orders", {}).values():
+        if order["side"] == "buy":
+            cash += order["reserved"]
+        else:
+            holdings[order["stock"]] = holdings.get(order["stock"], 0) + order["quantity"]
+    return (cash, holdings)
+
+leaderboard = Leaderboard()
+# 백엔드가 유저를 저장할 때마다 함께 갱신해 둔 요약이라서, 유저 데이터를 훑지 않고 바로 랭킹과 주문장을 만듭니다.
+_user_summaries, _initial_orders = _backend.load_summaries()
+users.register_all(_user_summaries)
+leaderboard.rebuild(_user_summaries)
+del _user_summaries
+DATA_LOAD_SECONDS = time.perf_counter() - _load_started  # 시작 시간 측정용 (요약 읽기와 랭킹 구성 포함)
+
+# 유저별 데이터 버전. 유저 데이터가 바뀔 때마다 올라가며 자산 현황 캐시의 키로 쓰입니다.
+# 캐시에 올라와 있는 유저만 가지며, 유저를 캐시에서 내릴 때 자산 현황 캐시와 함께 지웁니다.
+_user_versions = {}
+
+def _forget_user(user_id):
+    """캐시에서 내린 유저의 버전과 자산 현황을 지웁니다. 다시 올라오면 버전 0부터 새로 셉니다."""
+    _user_versions.pop(user_id, None)
+    portfolio_cache.invalidate(user_id)
+
+def _user_changed(user_id):
+    """유저 데이터가 바뀐 뒤 호출합니다. 저장 표시, 랭킹 갱신, 자산 현황 캐시 무효화를 함께 처리합니다."""
+    _user_versions[user_id] = _user_versions.get(user_id, 0) + 1
+    portfolio_cache.invalidate(user_id)
+    leaderboard.update_user(user_id, users[user_id])
+    mark_user_dirty(user_id)
+
+# 시세나 유통량이 바뀔 때마다 올라가는 버전. 화면 표시용 캐시가 이 값으로 최신 여부를 판단합니다.
+# price_version 은 시세 갱신 때만 올라가며, 가격에만 의존하는 자산 현황 캐시가 씁니다.
+market_version = 0
+price_version = 0
+_market_version_lock = threading.Lock()
+
+def _stocks_changed(*names, prices=False):
+    """종목 데이터가 바뀐 뒤 호출합니다. 시장 버전을 올리고 저장을 표시합니다. 이름이 없으면 전체 종목."""
+    global market_version, price_version
+    with _market_version_lock:
+        market_version += 1
+        if prices:
+            price_version += 1
+    mark_stocks_dirty(*names)
+
+def get_market_version():
+    return market_version
+
+def get_leaderboard(limit=10):
+    """총 자산 상위 유저 목록 [(user_id, 총자산), ...]"""
+    return leaderboard.top(limit)
+
+def get_user_rank(user_id):
+    return leaderboard.rank(user_id)
+
+# --- 시세 기록 (원형 버퍼 + 봉 차트) ---
+class _RingBuffer:
+    """고정 크기 배열 여러 개를 같은 위치로 함께 돌리는 원형 버퍼. 메모리 사용량은 capacity 로 고정됩니다."""
+
+    def __init__(self, capacity, fields):
+        self.capacity = capacity
+        self.columns = {field: array('d', bytes(8 * capacity)) for field in fields}
+        self.start = 0
+        self.count = 0
+
+    def append(self, **values):
+        pos = (self.start + self.count) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+        else:
+            self.start = (self.start + 1) % self.capacity
+        for field, value in values.items():
+            self.columns[field][pos] = value
+
+    def set_last(self, field, value):
+        self.columns[field][(self.start + self.count - 1) % self.capacity] = value
+
+    def get_last(self, field):
+        return self.columns[field][(self.start + self.count - 1) % self.capacity]
+
+    def tail(self, limit):
+        """가장 최근 limit 개를 오래된 순서로 [(필드 값, ...), ...] 로 돌려줍니다."""
+        limit = min(limit, self.count)
+        positions = [(self.start + self.count - limit + i) % self.capacity for i in range(limit)]
+        columns = list(self.columns.values())
+        return [tuple(column[pos] for column in columns) for pos in positions]
+
+
+class PriceHistory:
+    """종목별 최근 틱 가격과, 틱이 들어올 때마다 갱신되는 1시간/1일 OHLC 봉을 보관합니다."""
+
+    def __init__(self, tick_capacity=HISTORY_TICKS, candle_intervals=CANDLE_INTERVALS):
+        self.tick_capacity = tick_capacity
+        self.candle_intervals = candle_intervals
+        self._ticks = {}    # 종목 -> _RingBuffer(time, price)
+        self._candles = {}  # (종목, 간격 이름) -> _RingBuffer(time, open, high, low, close)
+        self._lock = threading.Lock()
+
+    def record(self, timestamp, names, prices):
+        with self._lock:
+            for name, price in zip(names, prices):
+                ticks = self._ticks.get(name)
+                if ticks is None:
+                    ticks = self._ticks[name] = _RingBuffer(self.tick_capacity, ("time", "price"))
+                ticks.append(time=timestamp, price=price)
+                for interval, (seconds, capacity) in self.candle_intervals.items():
+                    self._roll_up(name, interval, seconds, capacity, timestamp, price)
+
+    def _roll_up(self, name, interval, seconds, capacity, timestamp, price):
+        candles = self._candles.get((name, interval))
+        if candles is None:
+            candles = self._candles[(name, interval)] = _RingBuffer(capacity, ("time", "open", "high", "low", "close"))
+        bucket = timestamp - timestamp % seconds
+        if candles.count and candles.get_last("time") == bucket:
+            candles.set_last("high", max(candles.get_last("high"), price))
+            candles.set_last("low", min(candles.get_last("low"), price))
+            candles.set_last("close", price)
+        else:
+            candles.append(time=bucket, open=price, high=price, low=price, close=price)
+
+    def ticks(self, name, limit):
+        with self._lock:
+            ticks = self._ticks.get(name)
+            return ticks.tail(limit) if ticks else []
+
+    def candles(self, name, interval, limit):
+        with self._lock:
+            candles = self._candles.get((name, interval))
+            return candles.tail(limit) if candles else []
+
+price_history = PriceHistory()
+price_history.record(time.time(), stocks.names, stocks.price)
+
+def get_price_history(stock_name, limit=60):
+    """최근 틱 가격 [(timestamp, price), ...] (오래된 순)"""
+    return price_history.ticks(stock_name, limit)
+
+def get_candles(stock_name, interval="1h", limit=24):
+    """최근 봉 [(시작 timestamp, 시가, 고가, 저가, 종가), ...] (오래된 순). interval 은 CANDLE_INTERVALS 의 키입니다."""
+    if interval not in CANDLE_INTERVALS:
+        raise ValueError(f"지원하지 않는 봉 간격입니다: {interval}")
+    return price_history.candles(stock_name, interval, limit)
+
+# --- 시장 이벤트 ---
+class MarketEventEngine:
+    """
+    분야/종목 단위 시장 이벤트를 메모리에서 관리합니다.
+    이벤트마다 시작/만료 시각이 있고, 효과(배율)는 만료 시점까지 1.0 쪽으로 서서히 줄어듭니다.
+    이벤트 목록이 바뀔 때(생성/만료)만 market_event.json 에 저장합니다.
+    """
+    def __init__(self, filename=MARKET_EVENT_FILE):
+        self.filename = filename
+        self.events = self._load()
+        self._save_lock = threading.Lock()
+
+    def _load(self):
+        data = load_data(self.filename, {"events": []})
+        if "events" in data:
+            return data["events"]
+        # 예전 형식({"sector": ..., "multiplier": ...})은 지금부터 최소 지속 시간 동안 유지되는 이벤트 하나로 옮깁니다.
+        if data.get("sector"):
+            now = time.time()
+            return [{"target_type": "sector", "target": data["sector"], "multiplier": data.get("multiplier", 1.0),
+                     "start": now, "expires": now + MARKET_EVENT_DURATION[0]}]
+        return []
+
+    def save(self, events):
+        """이벤트 목록을 원자적으로 저장합니다. 종목 잠금 밖에서 호출합니다."""
+        with self._save_lock:
+            try:
+                write_json_atomic(self.filename, {"events": events})
+            except IOError as e:
+                print(f"데이터 저장 오류 {self.filename}: {e}", file=sys.stderr)
+
+    def tick(self, now, sector_names, stock_names):
+        """
+        만료된 이벤트를 정리하고, 확률에 따라 새 이벤트를 만듭니다.
+        목록이 바뀌었으면 저장할 목록(복사본)을, 아니면 None 을 돌려줍니다.
+        """
+        changed = False
+        active = [event for event in self.events if event["expires"] > now]
+        if len(active) != len(self.events):
+            self.events = active
+            changed = True
+        if len(self.events) < MARKET_EVENT_MAX_ACTIVE and random.random() < MARKET_EVENT_CHANCE:
+            if random.random() < MARKET_STOCK_EVENT_RATIO:
+                target_type, target = "stock", random.choice(stock_names)
+            else:
+                target_type, target = "sector", random.choice(sector_names)
+            self.events.append({"target_type": target_type, "target": target,
+                                "multiplier": random.uniform(0.85, 1.15),
+                                "start": now, "expires": now + random.uniform(*MARKET_EVENT_DURATION)})
+            changed = True
+        return list(self.events) if changed else None
+
+    @staticmethod
+    def effective_multiplier(event, now):
+        duration = event["expires"] - event["start"]
+        remaining = max(0.0, min(1.0, (event["expires"] - now) / duration)) if duration > 0 else 0.0
+        return 1.0 + (event["multiplier"] - 1.0) * remaining
+
+    def bonuses(self, now):
+        """현재 시점의 ({분야: 추가 변동률%}, {종목: 추가 변동률%})"""
+        sector_bonus, stock_bonus = {}, {}
+        for event in self.events:
+            bonus = 10 * (self.effective_multiplier(event, now) - 1.0)
+            target_bonus = sector_bonus if event["target_type"] == "sector" else stock_bonus
+            target_bonus[event["target"]] = target_bonus.get(event["target"], 0.0) + bonus
+        return sector_bonus, stock_bonus
+
+market_events = MarketEventEngine()
+
+def get_active_events():
+    """진행 중인 이벤트 목록 [{"target_type", "target", "multiplier"(현재 효과), "expires"}, ...]"""
+    now = time.time()
+    return [{"target_type": event["target_type"], "target": event["target"],
+             "multiplier": market_events.effective_multiplier(event, now), "expires": event["expires"]}
+            for event in market_events.events if event["expires"] > now]
 
 # --- 현실적인 주가 변동 시스템 ---
 def update_stock_prices():
     global stock_changes
-    stock_changes = {}
-    
-    market_events = {}
-    if random.random() < 0.2:
-        sectors = list(set(s['sector'] for s in stocks.values()))
-        event_sector = random.choice(sectors)
-        event_multiplier = random.uniform(0.85, 1.15)
-        market_events = {"sector": event_sector, "multiplier": event_multiplier}
-        save_data(MARKET_EVENT_FILE, market_events)
-    else:
-        market_events = load_data(MARKET_EVENT_FILE, {})
-
-    for name, data in stocks.items():
-        volatility = data.get('volatility', 1.0)
-        base_change = random.uniform(-2.0 * volatility, 2.0 * volatility)
-        
-        demand_pressure = 0
-        if data['total_shares'] > 0:
-            shares_held = data['total_shares'] - data['available_shares']
-            demand_pressure = (shares_held / data['total_shares']) * 5.0
-
-        sector_bonus = 0
-        if market_events and data['sector'] == market_events.get('sector'):
-            sector_bonus = 10 * (market_events.get('multiplier', 1.0) - 1.0)
-
-        total_percent_change = base_change + demand_pressure + sector_bonus
-        change_amount = data['price'] * (total_percent_change / 100)
-        new_price = max(1.0, round(data['price'] + change_amount, 2))
-        
-        stocks[name]['price'] = new_price
-        stock_changes[name] = (change_amount, total_percent_change)
+    # 시세 갱신 중에는 모든 종목을 잠가, 거래가 갱신 전후 가격을 섞어 쓰지 않게 합니다.
+    with transaction(stock_names=stocks.names):
+        now = time.time()
+        changed_events = market_events.tick(now, stocks.sector_names, stocks.names)
+        sector_events, stock_events = market_events.bonuses(now)
+        sector_bonus = [sector_events.get(sector, 0.0) for sector in stocks.sector_names]
 
-    save_data(STOCK_FILE, stocks)
-    return stock_changes
+        change_amounts, percent_changes = stocks.apply_tick(sector_bonus, stock_events)
+        stock_changes = dict(zip(stocks.names, zip(change_amounts, percent_changes)))
+        price_history.record(now, stocks.names, stocks.price)
+        changes = stock_changes
+    # 랭킹 재계산과 파일 쓰기는 모든 종목을 잠근 채로 하지 않습니다. 그동안 거래가 멈추지 않게 합니다.
+    # 랭킹은 자체 잠금이 있고, 시세는 이 스레드만 바꾸므로 잠금 밖에서도 이번 틱의 가격을 읽습니다.
+    leaderboard.refresh_prices(changes.keys())
+    _stocks_changed(prices=True)
+    if changed_events is not None:
+        market_events.save(changed_events)
+    return changes
 
 # --- 유저 관련 함수 (거래 수수료 및 수량 제한 추가) ---
 def get_user(user_id):
-    if user_id not in users:
-        users[user_id] = copy.deepcopy(DEFAULT_USER)
-    return users[user_id]
+    user = users.get(user_id)
+    if user is None:
+        with _users_lock:
+            # 저장소에도 없는 유저(새 유저, 또는 한 번도 바뀌지 않은 채 캐시에서 내려간 유저)는 기본값으로 만듭니다.
+            user = users.get(user_id)
+            if user is None:
+                user = users[user_id] = copy.deepcopy(DEFAULT_USER)
+                leaderboard.update_user(user_id, user)
+    return user
 
 def load_users():
     return users
 
+@_user_transaction()
 def claim_daily(user_id, amount):
     user = get_user(user_id)
     today_str = datetime.utcnow().date().strftime("%Y-%m-%d")
@@ -107,9 +1441,10 @@ def claim_daily(user_id, amount):
         return False, {"message": "오늘은 이미 출석했습니다."}
     user["balance"] = user.get("balance", 0) + amount
     user["last_claim_date"] = today_str
-    save_users()
+    _user_changed(user_id)
     return True, {"new_balance": user["balance"]}
 
+@_user_transaction(with_stock=True)
 def buy_stock(user_id, stock_name, amount):
     user = get_user(user_id)
     if stock_name not in stocks:
@@ -143,10 +1478,11 @@ def buy_stock(user_id, stock_name, amount):
     
     stocks[stock_name]['available_shares'] -= amount
 
-    save_users()
-    save_data(STOCK_FILE, stocks)
+    _user_changed(user_id)
+    _stocks_changed(stock_name)
     return True, {"amount": amount, "total_cost": total_cost, "fee": fee, "new_balance": user["balance"]}
 
+@_user_transaction(with_stock=True)
 def sell_stock(user_id, stock_name, amount_to_sell):
     user = get_user(user_id)
     if stock_name not in user.get("stocks", {}):
@@ -175,17 +1511,58 @@ def sell_stock(user_id, stock_name, amount_to_sell):
     
     stocks[stock_name]['available_shares'] += amount_to_sell
 
-    save_users()
-    save_data(STOCK_FILE, stocks)
+    _user_changed(user_id)
+    _stocks_changed(stock_name)
     return True, {"amount": amount_to_sell, "total_revenue": total_revenue, "fee": fee, "new_balance": user["balance"]}
 
+# --- 자산 현황 캐시 ---
+class PortfolioCache:
+    """유저별 자산 현황(표 문자열 + 총 자산)을 (유저 버전, 시세 버전) 기준으로 보관하는 LRU 캐시."""
+
+    def __init__(self, max_size=PORTFOLIO_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()  # user_id -> ((유저 버전, 시세 버전), {"text": ..., "total_assets": ...})
+        self._lock = threading.Lock()
+
+    def get(self, user_id, version):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[1]
+
+    def put(self, user_id, version, view):
+        with self._lock:
+            self._entries[user_id] = (version, view)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+portfolio_cache = PortfolioCache()
+
+def _portfolio_version(user_id):
+    return (_user_versions.get(user_id, 0), price_version)
+
+@_user_transaction()
 def get_portfolio(user_id):
-    user = get_user(user_id)
+    version = _portfolio_version(user_id)
+    view = portfolio_cache.get(user_id, version)
+    if view is None:
+        view = _render_portfolio(get_user(user_id))
+        portfolio_cache.put(user_id, version, view)
+    return view["text"]
+
+def _render_portfolio(user):
     header = "📌 종목     | 📦 보유량 | 💵 구매가   | 📈 현재가   | 📊 수익률   \n" + "─" * 63
     table_rows, total_investment, total_current_value = [], 0, 0
 
     for stock, (quantity, avg_price) in user.get("stocks", {}).items():
-        current_price = stocks.get(stock, {}).get('price', 0)
+        current_price = stocks.price_of(stock)
         investment = quantity * avg_price
         current_value = quantity * current_price
         total_investment += investment
@@ -194,26 +1571,233 @@ def get_portfolio(user_id):
         profit_str = f"{'▲' if profit_percent >= 0 else '▼'} {profit_percent:+.2f}%"
         table_rows.append(f"{stock:<11} | {quantity:>7}주 | ${avg_price:>8.2f} | ${current_price:>8.2f} | {profit_str:>9}")
 
+    # 지정가 주문에 묶여 있는 현금과 주식(현재가 기준)
+    reserved_value = sum(order["reserved"] if order["side"] == "buy" else order["quantity"] * stocks.price_of(order["stock"])
+                         for order in user.get("orders", {}).values())
+    reserved_line = f"🔒 **주문 대기**: `${reserved_value:,.2f}`\n" if reserved_value else ""
+
     if not table_rows:
-        return f"\n💰 현금 잔액: `${user['balance']:,.2f}`\n📭 보유 주식이 없습니다."
+        return {"text": f"\n💰 현금 잔액: `${user['balance']:,.2f}`\n{reserved_line}📭 보유 주식이 없습니다.",
+                "total_assets": user['balance'] + reserved_value}
 
     total_profit_percent = ((total_current_value - total_investment) / total_investment) * 100 if total_investment > 0 else 0
-    total_assets = user['balance'] + total_current_value
+    total_assets = user['balance'] + total_current_value + reserved_value
     
     summary = (f"💰 **현금 잔액**: `${user['balance']:,.2f}`\n"
                f"📈 **주식 가치**: `${total_current_value:,.2f}`\n"
+               f"{reserved_line}"
                f"💎 **총 자산**: `${total_assets:,.2f}`\n"
                f"📊 **총 수익률**: `{'▲' if total_profit_percent >= 0 else '▼'} {abs(total_profit_percent):.2f}%`")
     
-    return f"{summary}\n\n**보유 목록**\n```\n{header}\n" + "\n".join(table_rows) + "\n" + "─" * 63 + "\n```"
+    text = f"{summary}\n\n**보유 목록**\n```\n{header}\n" + "\n".join(table_rows) + "\n" + "─" * 63 + "\n```"
+    return {"text": text, "total_assets": total_assets}
 
+@_user_transaction()
 def calculate_total_assets(user_id):
+    # 최근에 자산 현황을 본 유저는 캐시된 합계를 그대로 씁니다.
+    view = portfolio_cache.get(user_id, _portfolio_version(user_id))
+    if view is not None:
+        return view["total_assets"]
+    cash, holdings = _summarize_user(get_user(user_id))
+    return cash + sum(quantity * stocks.price_of(name) for name, quantity in holdings.items())
+
+# --- 지정가 주문 ---
+# 주문은 유저 데이터의 "orders" 에 저장되고(저장/복구는 유저 데이터와 함께), 아래 주문장은 매칭 순서를 위한 색인입니다.
+# 매수 주문은 (지정가 x 수량 + 수수료)만큼의 현금을, 매도 주문은 해당 수량의 주식을 주문 시점에 미리 묶어 둡니다.
+class OrderBook:
+    """종목별 가격 우선(같은 가격이면 먼저 들어온 순) 힙. 취소된 주문은 힙에서 바로 빼지 않고 매칭할 때 건너뜁니다."""
+
+    def __init__(self):
+        self._buys = {}     # 종목 -> [(-지정가, 순번, 주문번호, user_id), ...] 최대 힙
+        self._sells = {}    # 종목 -> [(지정가, 순번, 주문번호, user_id), ...] 최소 힙
+        self._active = set()
+        self._stale = 0
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def add(self, order_id, user_id, order):
+        with self._lock:
+            if order["side"] == "buy":
+                heapq.heappush(self._buys.setdefault(order["stock"], []), (-order["limit"], next(self._seq), order_id, user_id))
+            else:
+                heapq.heappush(self._sells.setdefault(order["stock"], []), (order["limit"], next(self._seq), order_id, user_id))
+            self._active.add(order_id)
+
+    def discard(self, order_id):
+        with self._lock:
+            if order_id in self._active:
+                self._active.remove(order_id)
+                self._stale += 1
+                if self._stale > len(self._active):
+                    self._compact()
+
+    def _compact(self):
+        for books in (self._buys, self._sells):
+            for name, heap in books.items():
+                books[name] = [entry for entry in heap if entry[2] in self._active]
+                heapq.heapify(books[name])
+        self._stale = 0
+
+    def pop_crossing(self, stock_name, price):
+        """현재가에 체결 가능한 주문을 가격 우선순위대로 꺼냅니다. [(주문번호, user_id), ...]"""
+        crossing = []
+        with self._lock:
+            buys = self._buys.get(stock_name, [])
+            while buys and -buys[0][0] >= price:
+                _, _, order_id, user_id = heapq.heappop(buys)
+                if order_id in self._active:
+                    crossing.append((order_id, user_id))
+            sells = self._sells.get(stock_name, [])
+            while sells and sells[0][0] <= price:
+                _, _, order_id, user_id = heapq.heappop(sells)
+                if order_id in self._active:
+                    crossing.append((order_id, user_id))
+            for order_id, _ in crossing:
+                self._active.discard(order_id)
+        return crossing
+
+    def stock_names(self):
+        with self._lock:
+            return [name for books in (self._buys, self._sells) for name, heap in books.items() if heap]
+
+    def __len__(self):
+        return len(self._active)
+
+def _load_order_book():
+    """시작할 때 훑어 둔 대기 주문으로 주문장을 다시 만들고, 다음 주문번호 생성기를 돌려줍니다."""
+    last_id = 0
+    for order_id, user_id, order in _initial_orders:
+        order_book.add(order_id, user_id, order)
+        last_id = max(last_id, int(order_id))
+    _initial_orders.clear()
+    return itertools.count(last_id + 1)
+
+order_book = OrderBook()
+_order_ids = _load_order_book()
+
+@_user_transaction(with_stock=True)
+def place_limit_order(user_id, stock_name, side, quantity, limit_price):
+    """지정가 주문을 넣고 필요한 현금/주식을 묶어 둡니다. side 는 "buy" 또는 "sell" 입니다."""
     user = get_user(user_id)
-    balance = user.get("balance", 0)
-    total_stock_value = sum(data[0] * stocks.get(name, {}).get('price', 0) for name, data in user.get("stocks", {}).items())
-    return balance + total_stock_value
+    if stock_name not in stocks:
+        return False, "❌ 해당 주식은 존재하지 않습니다."
+    if side not in ("buy", "sell"):
+        return False, "❌ 주문 종류는 매수 또는 매도여야 합니다."
+    # NaN/무한대 가격은 잔액과 주문장 정렬을 망가뜨리므로 받지 않습니다. 0.005 미만은 반올림하면 0이 됩니다.
+    if quantity <= 0 or not math.isfinite(limit_price) or round(limit_price, 2) <= 0:
+        return False, "❌ 수량과 가격은 0보다 커야 합니다."
+
+    order = {"side": side, "stock": stock_name, "quantity": quantity, "limit": round(limit_price, 2), "created": time.time()}
+    if side == "buy":
+        reserved = round(order["limit"] * quantity * (1 + TRADING_FEE_RATE), 2)
+        if user["balance"] < reserved:
+            return False, f"💰 잔액이 부족합니다. (수수료 포함 예약 금액: ${reserved:,.2f})"
+        user["balance"] = round(user["balance"] - reserved, 2)
+        order["reserved"] = reserved
+    else:
+        held_quantity, avg_price = user["stocks"].get(stock_name, [0, 0])
+        if held_quantity < quantity:
+            return False, f"❌ **{stock_name}** 주식이 부족합니다. (보유량: {held_quantity}주)"
+        if held_quantity == quantity:
+            del user["stocks"][stock_name]
+        else:
+            user["stocks"][stock_name][0] = held_quantity - quantity
+        order["avg_price"] = avg_price
+
+    order_id = str(next(_order_ids))
+    user.setdefault("orders", {})[order_id] = order
+    order_book.add(order_id, user_id, order)
+    _user_changed(user_id)
+    return True, {"order_id": order_id, **order}
+
+def _restore_shares(user, stock_name, quantity, avg_price):
+    """매도 주문에 묶였던 주식을 평균 단가를 유지하며 보유 목록으로 되돌립니다."""
+    held_quantity, held_avg = user["stocks"].get(stock_name, [0, 0])
+    new_quantity = held_quantity + quantity
+    user["stocks"][stock_name] = [new_quantity, round((held_quantity * held_avg + quantity * avg_price) / new_quantity, 2)]
+
+@_user_transaction()
+def cancel_limit_order(user_id, order_id):
+    user = get_user(user_id)
+    order = user.get("orders", {}).pop(order_id, None)
+    if order is None:
+        return False, "❌ 해당 번호의 대기 주문이 없습니다."
+    if order["side"] == "buy":
+        user["balance"] = round(user["balance"] + order["reserved"], 2)
+    else:
+        _restore_shares(user, order["stock"], order["quantity"], order["avg_price"])
+    if not user["orders"]:
+        del user["orders"]
+    order_book.discard(order_id)
+    _user_changed(user_id)
+    return True, order
+
+def get_open_orders(user_id):
+    """유저의 대기 주문 목록 [(주문번호, 주문), ...] (오래된 순)"""
+    with transaction((user_id,)):
+        return sorted(copy.deepcopy(get_user(user_id).get("orders", {})).items(), key=lambda item: int(item[0]))
+
+def _fill_order(user_id, order_id, stock_name):
+    """주문 하나를 현재가로 체결합니다. 체결된 수량을 돌려주며, 남은 수량이 있으면 주문장에 다시 넣습니다."""
+    with transaction((user_id,), (stock_name,)):
+        user = users.get(user_id)
+        order = user.get("orders", {}).get(order_id) if user else None
+        if order is None:
+            return 0
+        stock_data = stocks[stock_name]
+        price = stock_data['price']
+        quantity = order["quantity"]
+
+        if order["side"] == "buy":
+            if price > order["limit"]:
+                order_book.add(order_id, user_id, order)
+                return 0
+            quantity = min(quantity, stock_data['available_shares'])
+            if quantity == 0:
+                order_book.add(order_id, user_id, order)
+                return 0
+            cost = price * quantity
+            used_reserve = round(order["reserved"] * quantity / order["quantity"], 2)
+            user["balance"] = round(user["balance"] + used_reserve - cost * (1 + TRADING_FEE_RATE), 2)
+            order["reserved"] = round(order["reserved"] - used_reserve, 2)
+            _restore_shares(user, stock_name, quantity, price)
+            stock_data['available_shares'] -= quantity
+        else:
+            if price < order["limit"]:
+                order_book.add(order_id, user_id, order)
+                return 0
+            user["balance"] = round(user["balance"] + price * quantity * (1 - TRADING_FEE_RATE), 2)
+            stock_data['available_shares'] += quantity
+
+        order["quantity"] -= quantity
+        if order["quantity"] > 0:
+            order_book.add(order_id, user_id, order)
+        else:
+            if order["side"] == "buy" and order["reserved"] > 0:
+                user["balance"] = round(user["balance"] + order["reserved"], 2)
+            del user["orders"][order_id]
+            if not user["orders"]:
+                del user["orders"]
+        _user_changed(user_id)
+        _stocks_changed(stock_name)
+        return quantity
+
+def match_limit_orders():
+    """
+    현재가에 닿은 지정가 주문을 종목별로 일괄 체결합니다. (시세 갱신 직후 호출)
+    주문장 힙에서 체결 가능한 주문만 꺼내므로 전체 대기 주문 수와 무관하게 O(k log n) 입니다.
+    체결 내역 [(user_id, 주문번호, 종목, 체결 수량), ...] 을 돌려줍니다.
+    """
+    fills = []
+    for stock_name in order_book.stock_names():
+        for order_id, user_id in order_book.pop_crossing(stock_name, stocks.price_of(stock_name)):
+            filled = _fill_order(user_id, order_id, stock_name)
+            if filled:
+                fills.append((user_id, order_id, stock_name, filled))
+    return fills
 
 # --- [수정] 도박 시스템: 게임 종류별로 함수 분리 ---
+@_user_transaction()
 def _validate_bet(user_id, bet_amount_str):
     """베팅 금액 유효성 검사 및 확정 내부 함수"""
     user = get_user(user_id)
@@ -234,6 +1818,7 @@ def _validate_bet(user_id, bet_amount_str):
         
     return True, {'user': user, 'bet_amount': bet_amount}
 
+@_user_transaction()
 def process_slot_machine(user_id, bet_amount_str):
     """슬롯머신 게임 로직"""
     is_valid, result = _validate_bet(user_id, bet_amount_str)
@@ -242,30 +1827,14 @@ def process_slot_machine(user_id, bet_amount_str):
 
     user, bet_amount = result['user'], result['bet_amount']
 
-    reels_config = [
-        ('💎', 20, 2),
-        ('💰', 10, 5),
-        ('7️⃣', 5, 8),
-        ('🍒', 2, 12),
-        ('💔', 0, 10)
-    ]
-    symbols = [item[0] for item in reels_config]
-    weights = [item[2] for item in reels_config]
-    
-    reels_result = random.choices(symbols, weights=weights, k=3)
-    winnings = 0
-    
-    if reels_result[0] == reels_result[1] == reels_result[2]:
-        symbol = reels_result[0]
-        multiplier = next((item[1] for item in reels_config if item[0] == symbol), 0)
-        winnings = bet_amount * multiplier
-    elif reels_result.count('🍒') == 2:
-        winnings = bet_amount 
+    reels_result = random.choices(payouts.SLOT_SYMBOLS, weights=payouts.SLOT_WEIGHTS, k=payouts.SLOT_REEL_COUNT)
+    winnings = bet_amount * payouts.slot_multiplier(reels_result)
 
     user['balance'] += winnings - bet_amount
-    save_users()
+    _user_changed(user_id)
     return True, {'reels': reels_result, 'winnings': winnings, 'bet_amount': bet_amount, 'new_balance': user['balance']}
 
+@_user_transaction()
 def process_dice_roll(user_id, bet_amount_str):
     """주사위 게임 로직"""
     is_valid, result = _validate_bet(user_id, bet_amount_str)
@@ -274,20 +1843,15 @@ def process_dice_roll(user_id, bet_amount_str):
 
     user, bet_amount = result['user'], result['bet_amount']
     
-    dice1 = random.randint(1, 6)
-    dice2 = random.randint(1, 6)
-    dice_sum = dice1 + dice2
-    winnings = 0
-    
-    if dice1 == dice2:
-        winnings = bet_amount * 4
-    elif dice_sum == 7:
-        winnings = bet_amount * 2
+    dice1 = random.randint(1, payouts.DICE_SIDES)
+    dice2 = random.randint(1, payouts.DICE_SIDES)
+    winnings = bet_amount * payouts.dice_multiplier(dice1, dice2)
         
     user['balance'] += winnings - bet_amount
-    save_users()
+    _user_changed(user_id)
     return True, {'dices': [dice1, dice2], 'winnings': winnings, 'bet_amount': bet_amount, 'new_balance': user['balance']}
 
+@_user_transaction()
 def process_coin_flip(user_id, bet_amount_str, choice):
     """동전던지기 게임 로직"""
     is_valid, result = _validate_bet(user_id, bet_amount_str)
@@ -296,15 +1860,12 @@ def process_coin_flip(user_id, bet_amount_str, choice):
 
     user, bet_amount = result['user'], result['bet_amount']
 
-    if choice not in ['앞', '뒤']:
+    if choice not in payouts.COIN_SIDES:
         return False, {'message': "'앞' 또는 '뒤'를 선택해주세요."}
 
-    coin_result = random.choice(['앞', '뒤'])
-    winnings = 0
-
-    if choice == coin_result:
-        winnings = bet_amount * 2
+    coin_result = random.choice(payouts.COIN_SIDES)
+    winnings = bet_amount * payouts.coin_multiplier(choice, coin_result)
     
     user['balance'] += winnings - bet_amount
-    save_users()
+    _user_changed(user_id)
     return True, {'result': coin_result, 'choice': choice, 'winnings': winnings, 'bet_amount': bet_amount, 'new_balance': user['balance']}
\ No newline at end of file
@@ -0,0 +1,337 @@
+# voice.py
+import asyncio
+import subprocess
+import sys
+import os
+import threading
+from array import array
+import discord
+
+try:
+    import audioop  # 파이썬 3.13 에서 제거됨. 없으면 순수 파이썬으로 섞습니다.
+except ImportError:
+    audioop = None
+
+# --- 효과음 설정 ---
+SOUND_DIR = "sounds"
+SOUND_EFFECTS = ("spin", "win", "lose")  # sounds/<이름>.mp3
+
+# 디스코드 음성은 48kHz 스테레오 16비트 PCM 을 20ms 단위(3840바이트)로 보냅니다.
+SAMPLE_RATE = 48000
+CHANNELS = 2
+FRAME_SAMPLES = 960
+FRAME_BYTES = FRAME_SAMPLES * CHANNELS * 2
+
+# --- 음성 연결 설정 ---
+VOICE_IDLE_TIMEOUT = 120  # 음악도 효과음도 없이 이 시간(초)이 지나면 음성 채널에서 나갑니다.
+
+
+def decode_pcm(path):
+    """ffmpeg 로 음원 파일 전체를 디코딩해 20ms PCM 프레임 목록으로 돌려줍니다. (블로킹)"""
+    process = subprocess.run(
+        ["ffmpeg", "-loglevel", "error", "-i", path, "-f", "s16le", "-ar", str(SAMPLE_RATE), "-ac", str(CHANNELS), "pipe:1"],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True,
+    )
+    pcm = process.stdout
+    # 마지막 프레임은 무음으로 채워서 길이를 맞춥니다.
+    if len(pcm) % FRAME_BYTES:
+        pcm += b"\x00" * (FRAME_BYTES - len(pcm) % FRAME_BYTES)
+    return [pcm[i:i + FRAME_BYTES] for i in range(0, len(pcm), FRAME_BYTES)]
+
+
+class PreloadedAudio(discord.AudioSource):
+    """메모리에 올려 둔 프레임 목록을 순서대로 재생하는 AudioSource. 프레임 목록은 여러 재생이 함께 씁니다."""
+    def __init__(self, frames, *, opus=False):
+        self.frames = frames
+        self.opus = opus
+        self.position = 0
+
+    def read(self):
+        if self.position >= len(self.frames):
+            return b""
+        frame = self.frames[self.position]
+        self.position += 1
+        return frame
+
+    def is_opus(self):
+        return self.opus
+
+
+class SoundBank:
+    """
+    효과음을 시작할 때 한 번만 디코딩해 메모리에 보관합니다.
+    재생할 때마다 ffmpeg 프로세스를 띄우지 않고, opus 라이브러리가 로드되어 있으면
+    인코딩까지 끝낸 Opus 프레임을 그대로 보냅니다.
+    """
+    def __init__(self, directory=SOUND_DIR, names=SOUND_EFFECTS):
+        self.directory = directory
+        self.names = names
+        self.pcm = {}   # 이름 -> PCM 프레임 목록
+        self.opus = {}  # 이름 -> Opus 프레임 목록 (처음 재생할 때 인코딩)
+
+    def load(self):
+        """모든 효과음을 디코딩합니다. (블로킹이므로 실행기에서 호출하세요)"""
+        for name in self.names:
+            path = os.path.join(self.directory, f"{name}.mp3")
+            try:
+                self.pcm[name] = decode_pcm(path)
+            except (OSError, subprocess.CalledProcessError) as e:
+                print(f"효과음 '{path}' 디코딩 실패: {e}", file=sys.stderr)
+        print(f"🔊 효과음 {len(self.pcm)}개를 메모리에 올렸습니다.")
+
+    def _encode_opus(self, name):
+        # opus 는 보통 음성 채널에 처음 연결할 때 로드되므로, 인코딩은 첫 재생 때 한 번만 합니다.
+        encoder = discord.opus.Encoder()
+        frames = [encoder.encode(frame, FRAME_SAMPLES) for frame in self.pcm[name]]
+        self.opus[name] = frames
+        return frames
+
+    def source(self, name, *, pcm=False):
+        """효과음을 재생할 새 AudioSource. 효과음이 없으면 None. 다른 소리와 섞을 때는 pcm=True."""
+        if name not in self.pcm:
+            return None
+        if not pcm and discord.opus.is_loaded():
+            frames = self.opus.get(name) or self._encode_opus(name)
+            return PreloadedAudio(frames, opus=True)
+        return PreloadedAudio(self.pcm[name])
+
+sound_bank = SoundBank()
+
+
+def mix_frames(a, b):
+    """16비트 PCM 프레임 두 개를 더합니다. (범위를 넘는 값은 잘라냄)"""
+    if audioop is not None:
+        return audioop.add(a, b, 2)
+    left, right = array('h', a), array('h', b)
+    return array('h', [max(-32768, min(32767, x + y)) for x, y in zip(left, right)]).tobytes()
+
+
+class MixerSource(discord.AudioSource):
+    """
+    음악(base) 위에 효과음들을 얹어서 재생하는 AudioSource.
+    음악이 끝나면 함께 끝나고, 효과음이 없을 때는 음악 프레임을 그대로 내보냅니다.
+    read() 는 음성 전송 스레드에서 호출됩니다.
+    """
+    def __init__(self, base, on_overlays_done=None):
+        self.base = base
+        self.overlays = []
+        self.on_overlays_done = on_overlays_done
+        # add/clear_overlays 는 이벤트 루프 스레드에서, read 는 전송 스레드에서 호출되므로 목록 교체를 잠금으로 보호합니다.
+        self._lock = threading.Lock()
+
+    def add(self, source):
+        with self._lock:
+            self.overlays = self.overlays + [source]
+
+    def clear_overlays(self):
+        with self._lock:
+            self.overlays = []
+
+    def read(self):
+        frame = self.base.read()
+        overlays = self.overlays
+        if not frame or not overlays:
+            return frame
+        # 섞는 동안에는 잠금을 잡지 않고, 끝난 효과음만 빼면서 그 사이에 추가된 효과음은 그대로 둡니다.
+        finished = []
+        for overlay in overlays:
+            effect = overlay.read()
+            if effect:
+                frame = mix_frames(frame, effect)
+            else:
+                finished.append(overlay)
+        if finished:
+            with self._lock:
+                self.overlays = [overlay for overlay in self.overlays if overlay not in finished]
+                done = not self.overlays
+            if done and self.on_overlays_done:
+                self.on_overlays_done()
+        return frame
+
+    def is_opus(self):
+        return False
+
+    def cleanup(self):
+        self.base.cleanup()
+
+
+class _GuildVoice:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.held = False            # 음악이 연결을 쓰는 중이면 True (자동으로 나가지 않음)
+        self.pending = []            # 다른 효과음이 끝나길 기다리는 효과음 이름
+        self.effect_playing = False  # 효과음을 (음악 없이) 단독으로 재생 중인지
+        self.idle = asyncio.Event()  # 재생 중이거나 대기 중인 효과음이 없을 때 set
+        self.idle.set()
+        self.idle_handle = None
+        # 이 연결에서 음악이나 효과음을 한 번이라도 재생했는지. !들어와 로만 들어온 채널은 유휴 시간으로 나가지 않습니다.
+        self.played = False
+
+
+class VoiceManager:
+    """
+    서버별 음성 연결을 음악 Cog 와 도박 효과음이 함께 씁니다.
+    - 연결은 바로 끊지 않고 VOICE_IDLE_TIMEOUT 동안 유지해 연속된 슬롯머신이 음성 연결을 다시 맺지 않게 합니다.
+      유휴 시간은 무언가를 재생한 뒤부터 셉니다. (불러서 들어오기만 한 채널에서는 나가지 않음)
+    - 음악이 나오는 중이면 효과음을 음악 위에 섞고, 효과음끼리는 순서대로 재생합니다.
+    - 음악이 연결을 잡고(hold) 있으면 효과음 때문에 다른 채널로 옮겨가지 않습니다.
+    이벤트 루프 스레드에서만 호출됩니다.
+    """
+    def __init__(self):
+        self._guilds = {}
+
+    def _state(self, guild):
+        state = self._guilds.get(guild.id)
+        if state is None:
+            state = self._guilds[guild.id] = _GuildVoice()
+        return state
+
+    async def connect(self, channel, *, move=False):
+        """
+        channel 에 연결된 VoiceClient 를 돌려줍니다.
+        음악이 다른 채널에서 재생 중이면 move=True 가 아닌 이상 옮기지 않고 None 을 돌려줍니다.
+        """
+        state = self._state(channel.guild)
+        async with state.lock:
+            self._cancel_idle(state)
+            voice_client = channel.guild.voice_client
+            if voice_client and voice_client.is_connected():
+                if voice_client.channel != channel:
+                    if state.held and not move:
+                        return None
+                    await voice_client.move_to(channel)
+            else:
+                voice_client = await channel.connect()
+            # 이미 재생한 적이 있는 연결이면 다시 유휴 시간을 셉니다.
+            self._schedule_idle(channel.guild, state)
+            return voice_client
+
+    async def disconnect(self, guild):
+        state = self._guilds.pop(guild.id, None)
+        if state:
+            self._cancel_idle(state)
+            state.idle.set()
+        if guild.voice_client:
+            await guild.voice_client.disconnect()
+
+    def hold(self, guild):
+        state = self._state(guild)
+        state.held = True
+        self._cancel_idle(state)
+
+    def release(self, guild):
+        state = self._guilds.get(guild.id)
+        if state:
+            state.held = False
+            self._schedule_idle(guild, state)
+
+    # --- 재생 ---
+    def play_music(self, guild, source, *, after=None):
+        """음악을 재생합니다. 단독으로 재생 중이던 효과음은 끊고, 이후 효과음은 음악 위에 섞입니다."""
+        state = self._state(guild)
+        voice_client = guild.voice_client
+        if voice_client.is_playing() or voice_client.is_paused():
+            voice_client.stop()
+        state.effect_playing = False
+        state.pending.clear()
+        state.idle.set()
+        state.played = True
+        loop = asyncio.get_running_loop()
+        mixer = MixerSource(source, on_overlays_done=lambda: loop.call_soon_threadsafe(self._check_idle, guild))
+        voice_client.play(mixer, after=after)
+
+    def play_effect(self, guild, name):
+        """
+        효과음을 재생합니다. 음악 중이면 섞고, 다른 효과음 중이면 그 뒤에 재생합니다.
+        일시정지 중에는 섞어도 읽히지 않다가 재개할 때 한꺼번에 나오므로 효과음을 건너뜁니다.
+        """
+        voice_client = guild.voice_client
+        if not voice_client or not voice_client.is_connected() or voice_client.is_paused() or name not in sound_bank.pcm:
+            return
+        state = self._state(guild)
+        self._cancel_idle(state)
+        state.played = True
+        current = voice_client.source if voice_client.is_playing() else None
+        if isinstance(current, MixerSource):
+            source = sound_bank.source(name, pcm=True)
+            if source is not None:
+                state.idle.clear()
+                current.add(source)
+        elif current is not None:
+            state.idle.clear()
+            state.pending.append(name)
+        else:
+            self._start_effect(guild, state, name)
+
+    def _start_effect(self, guild, state, name):
+        source = sound_bank.source(name)
+        state.idle.clear()
+        state.effect_playing = True
+        loop = asyncio.get_running_loop()
+        guild.voice_client.play(source, after=lambda e: loop.call_soon_threadsafe(self._effect_finished, guild))
+
+    def _effect_finished(self, guild):
+        state = self._guilds.get(guild.id)
+        if state is None or not state.effect_playing:
+            return  # 음악이 효과음을 끊고 시작한 경우
+        state.effect_playing = False
+        voice_client = guild.voice_client
+        if state.pending and voice_client and voice_client.is_connected() and not voice_client.is_playing():
+            return self._start_effect(guild, state, state.pending.pop(0))
+        state.pending.clear()
+        self._check_idle(guild)
+
+    def pause_music(self, guild):
+        """음악을 일시정지합니다. 음악 위에 섞이던 효과음은 버려서 효과음을 기다리던 쪽이 멈춰 있지 않게 합니다."""
+        voice_client = guild.voice_client
+        if not voice_client or not voice_client.is_playing():
+            return False
+        voice_client.pause()
+        if isinstance(voice_client.source, MixerSource):
+            voice_client.source.clear_overlays()
+        self._check_idle(guild)
+        return True
+
+    async def wait_effects(self, guild, timeout=10):
+        """지금 재생 중이거나 대기 중인 효과음이 모두 끝날 때까지 (최대 timeout 초) 기다립니다."""
+        state = self._guilds.get(guild.id)
+        if state:
+            try:
+                await asyncio.wait_for(state.idle.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    # --- 유휴 연결 정리 ---
+    def _check_idle(self, guild):
+        state = self._guilds.get(guild.id)
+        if state is None or state.effect_playing or state.pending:
+            return
+        voice_client = guild.voice_client
+        current = voice_client.source if voice_client and voice_client.is_playing() else None
+        if isinstance(current, MixerSource) and current.overlays:
+            return
+        state.idle.set()
+        self._schedule_idle(guild, state)
+
+    def _schedule_idle(self, guild, state):
+        self._cancel_idle(state)
+        if state.held or not state.played:
+            return
+        loop = asyncio.get_running_loop()
+        state.idle_handle = loop.call_later(VOICE_IDLE_TIMEOUT, lambda: loop.create_task(self._disconnect_if_idle(guild)))
+
+    def _cancel_idle(self, state):
+        if state.idle_handle:
+            state.idle_handle.cancel()
+            state.idle_handle = None
+
+    async def _disconnect_if_idle(self, guild):
+        state = self._guilds.get(guild.id)
+        voice_client = guild.voice_client
+        if state is None or state.held or not state.idle.is_set():
+            return
+        if voice_client and (voice_client.is_playing() or voice_client.is_paused()):
+            return self._schedule_idle(guild, state)
+        await self.disconnect(guild)
+
+voice_manager = VoiceManager()